@@ -12,6 +12,7 @@ from pathlib import Path
 
 import os
 import dj_database_url
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 from datetime import timedelta
 
@@ -55,11 +56,15 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.ClaimsJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
-    ]
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
 AUTH_USER_MODEL = 'api.User'
@@ -67,17 +72,22 @@ AUTH_USER_MODEL = 'api.User'
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=60),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
+    "TOKEN_OBTAIN_SERIALIZER": "api.serializers.ClaimsTokenObtainPairSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "api.serializers.ClaimsTokenRefreshSerializer",
+    "TOKEN_USER_CLASS": "api.authentication.ClaimsUser",
 }
 
-BASE_DIR = Path(__file__).resolve().parent.parent
-
-# Load environment variables from .env file
-load_dotenv(os.path.join(BASE_DIR, '.env'))
+# How long each process trusts its cached copy of a User row. Bounds how long
+# an access token keeps working after its claims are invalidated.
+AUTH_USER_CACHE_SECONDS = int(os.environ.get('AUTH_USER_CACHE_SECONDS', '30'))
+# Most users each process keeps cached; the least recently used go first.
+AUTH_USER_CACHE_MAX_ENTRIES = int(os.environ.get('AUTH_USER_CACHE_MAX_ENTRIES', '10000'))
 
 HF_API_TOKEN = os.getenv("HF_API_TOKEN")
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'api.middleware.CompressionMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -85,6 +95,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.db_routers.ReplicaPinningMiddleware',
 ]
 
 ROOT_URLCONF = 'DeepTattooAI.urls'
@@ -124,6 +135,49 @@ else:
         }
     }
 
+# Read replicas, e.g. DATABASE_REPLICA_URLS=postgres://replica-1/db,postgres://replica-2/db
+# Only views using ReplicaReadMixin read from them; writes always go to 'default'.
+READ_REPLICAS = []
+for index, url in enumerate(os.environ.get('DATABASE_REPLICA_URLS', '').split(',')):
+    if url.strip():
+        alias = f'replica_{index + 1}'
+        DATABASES[alias] = dj_database_url.parse(
+            url.strip(),
+            conn_max_age=600,
+            ssl_require=url.strip().startswith('postgres'),
+        )
+        DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+        READ_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['api.db_routers.ReplicaRouter']
+
+# After a write, a user's reads stay on the primary for this long (read-your-writes).
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', '10'))
+
+# Shared cache for replica pins. Use Redis when several processes serve traffic.
+if 'REDIS_URL' in os.environ:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# A pin set by one gunicorn worker must be seen by the others, or a user's
+# read after a write can land on a lagging replica.
+if READ_REPLICAS and CACHES['default']['BACKEND'] in (
+    'django.core.cache.backends.locmem.LocMemCache', 'django.core.cache.backends.dummy.DummyCache',
+):
+    raise ImproperlyConfigured(
+        "DATABASE_REPLICA_URLS requires a cache shared between processes for replica pins; set REDIS_URL."
+    )
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -193,3 +247,88 @@ else:
     # Local media file settings 
     MEDIA_URL = '/media/'
     MEDIA_ROOT = BASE_DIR / 'media'
+
+# Where generated images are written: 'r2' or 'local' (files under MEDIA_ROOT).
+BLOB_STORAGE_BACKEND = os.environ.get('BLOB_STORAGE_BACKEND', 'r2' if USE_CLOUD_STORAGE else 'local')
+
+
+# Data retention
+# Raw APIUsage rows are rolled up into daily/monthly totals before they expire.
+USAGE_RETENTION_DAYS = int(os.environ.get('USAGE_RETENTION_DAYS', '90'))
+FAILED_DESIGN_RETENTION_DAYS = int(os.environ.get('FAILED_DESIGN_RETENTION_DAYS', '30'))
+ABANDONED_DESIGN_RETENTION_HOURS = int(os.environ.get('ABANDONED_DESIGN_RETENTION_HOURS', '24'))
+ORPHAN_IMAGE_GRACE_HOURS = int(os.environ.get('ORPHAN_IMAGE_GRACE_HOURS', '24'))
+RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', '1000'))
+RETENTION_BATCH_PAUSE = float(os.environ.get('RETENTION_BATCH_PAUSE', '0.1'))
+
+
+# Generation leases
+# A worker holds a lease on each design it is generating and renews it on a
+# heartbeat. Leases that expire are requeued or failed by `reap_generations`.
+HF_REQUEST_TIMEOUT = float(os.environ.get('HF_REQUEST_TIMEOUT', '120'))
+GENERATION_LEASE_SECONDS = int(os.environ.get('GENERATION_LEASE_SECONDS', '90'))
+GENERATION_HEARTBEAT_SECONDS = int(os.environ.get('GENERATION_HEARTBEAT_SECONDS', '30'))
+GENERATION_MAX_ATTEMPTS = int(os.environ.get('GENERATION_MAX_ATTEMPTS', '3'))
+# Between renewals, how often a worker checks its design wasn't cancelled or deleted.
+GENERATION_CANCEL_CHECK_SECONDS = int(os.environ.get('GENERATION_CANCEL_CHECK_SECONDS', '2'))
+
+
+# Design library export: how many images to fetch from storage ahead of the ZIP writer.
+EXPORT_PREFETCH_CONCURRENCY = int(os.environ.get('EXPORT_PREFETCH_CONCURRENCY', '4'))
+
+
+# Admission control for new generations
+# At GENERATION_CAPACITY processing designs every create is refused with 503;
+# free-tier creates are refused with 429 once load passes their share of it.
+GENERATION_CAPACITY = int(os.environ.get('GENERATION_CAPACITY', '50'))
+GENERATION_FREE_TIER_SHARE = float(os.environ.get('GENERATION_FREE_TIER_SHARE', '0.7'))
+GENERATION_DEFAULT_SECONDS = float(os.environ.get('GENERATION_DEFAULT_SECONDS', '20'))
+ADMISSION_LOAD_CACHE_SECONDS = float(os.environ.get('ADMISSION_LOAD_CACHE_SECONDS', '1'))
+
+
+# Render sizes and steps for FLUX.1-schnell. Progressive designs get a quick
+# preview first, then the full render after PREVIEW_HOLD_SECONDS unless discarded.
+FULL_RENDER_SIZE = int(os.environ.get('FULL_RENDER_SIZE', '1024'))
+FULL_INFERENCE_STEPS = int(os.environ.get('FULL_INFERENCE_STEPS', '4'))
+PREVIEW_RENDER_SIZE = int(os.environ.get('PREVIEW_RENDER_SIZE', '512'))
+PREVIEW_INFERENCE_STEPS = int(os.environ.get('PREVIEW_INFERENCE_STEPS', '1'))
+PREVIEW_HOLD_SECONDS = float(os.environ.get('PREVIEW_HOLD_SECONDS', '3'))
+PROGRESSIVE_GENERATION_DEFAULT = os.environ.get('PROGRESSIVE_GENERATION_DEFAULT', 'False') == 'True'
+
+# Response compression (api.middleware.CompressionMiddleware). Brotli is used
+# when the `brotli` package is installed and the client accepts it.
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', '1024'))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', '5'))
+
+# Longest window the generation stats endpoint will summarise, in hours.
+STATS_MAX_HOURS = int(os.environ.get('STATS_MAX_HOURS', str(24 * 90)))
+
+# Source photos for image-to-image generation. Requests only check the
+# upload's header; the generation task auto-orients it, strips metadata,
+# downscales it to the model's input size and re-encodes it as JPEG in a
+# pool of IMAGE_PROCESS_WORKERS processes.
+IMG2IMG_API_URL = os.environ.get(
+    'IMG2IMG_API_URL',
+    'https://router.huggingface.co/hf-inference/models/stabilityai/stable-diffusion-xl-refiner-1.0',
+)
+SOURCE_IMAGE_STRENGTH = float(os.environ.get('SOURCE_IMAGE_STRENGTH', '0.75'))
+# Steps for the SDXL refiner; only about SOURCE_IMAGE_STRENGTH of them denoise.
+IMG2IMG_FULL_INFERENCE_STEPS = int(os.environ.get('IMG2IMG_FULL_INFERENCE_STEPS', '40'))
+IMG2IMG_PREVIEW_INFERENCE_STEPS = int(os.environ.get('IMG2IMG_PREVIEW_INFERENCE_STEPS', '12'))
+SOURCE_IMAGE_MAX_SIDE = int(os.environ.get('SOURCE_IMAGE_MAX_SIDE', str(FULL_RENDER_SIZE)))
+SOURCE_IMAGE_MAX_PIXELS = int(os.environ.get('SOURCE_IMAGE_MAX_PIXELS', str(50_000_000)))
+SOURCE_IMAGE_MAX_UPLOAD_BYTES = int(os.environ.get('SOURCE_IMAGE_MAX_UPLOAD_BYTES', str(20 * 1024 * 1024)))
+SOURCE_IMAGE_QUALITY = int(os.environ.get('SOURCE_IMAGE_QUALITY', '85'))
+SOURCE_IMAGE_TIMEOUT = float(os.environ.get('SOURCE_IMAGE_TIMEOUT', '20'))
+IMAGE_PROCESS_WORKERS = int(os.environ.get('IMAGE_PROCESS_WORKERS', '2'))
+
+# Idempotency-Key support on design creation. Completed responses are
+# replayed for IDEMPOTENCY_KEY_TTL_HOURS; a duplicate of a request still in
+# flight waits up to IDEMPOTENCY_WAIT_SECONDS for its result.
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_KEY_TTL_HOURS', '24'))
+IDEMPOTENCY_PENDING_SECONDS = int(os.environ.get('IDEMPOTENCY_PENDING_SECONDS', '60'))
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', '10'))
+IDEMPOTENCY_POLL_SECONDS = float(os.environ.get('IDEMPOTENCY_POLL_SECONDS', '0.25'))
+
+# Path the gunicorn master requests once before forking workers (see gunicorn.conf.py).
+WARMUP_PATH = os.environ.get('WARMUP_PATH', '/api/styles/')
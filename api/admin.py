@@ -1,13 +1,145 @@
 from django.contrib import admin
-from .models import User, TattooStyle, TattooDesign, Subscription, APIUsage, UserFavorite
+from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from .models import (
+    User, TattooStyle, TattooDesign, Subscription, APIUsage, UserFavorite,
+    APIUsageDailyRollup, APIUsageMonthlyRollup, RetentionCheckpoint, ImageBlob, GenerationStatsBucket,
+)
 
+# Below this many rows an exact COUNT(*) is cheap enough to keep.
+ESTIMATED_COUNT_THRESHOLD = 10000
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that reads the planner's row estimate from pg_class.reltuples
+    for unfiltered changelists on PostgreSQL instead of running COUNT(*).
+    Filtered querysets, small tables and other databases get an exact count.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = self._estimated_count(queryset)
+            if estimate is not None and estimate >= ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return super().count
+
+    @staticmethod
+    def _estimated_count(queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        # reltuples is -1 for tables that have never been analyzed
+        if row is None or row[0] < 0:
+            return None
+        return row[0]
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist defaults for tables that grow with user activity."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+
+
+@admin.register(User)
+class UserAdmin(BaseUserAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_display = ('username', 'email', 'is_pro', 'is_staff', 'date_joined')
+    list_filter = ('is_pro', 'is_staff', 'is_active')
+    search_fields = ('username', 'email')
+    fieldsets = BaseUserAdmin.fieldsets + (
+        ('Pro', {'fields': ('is_pro', 'pro_subscription_date', 'profile_picture')}),
+    )
+
+
+@admin.register(TattooStyle)
 class TattooStyleAdmin(admin.ModelAdmin):
     list_display = ('display_name', 'name', 'is_active')
     list_filter = ('is_active',)
+    search_fields = ('name', 'display_name')
+
+
+@admin.register(TattooDesign)
+class TattooDesignAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'style', 'status', 'is_public', 'created_at')
+    list_select_related = ('user', 'style')
+    list_filter = ('status', 'is_public')
+    search_fields = ('=user__username',)
+    ordering = ('-created_at',)
+    raw_id_fields = ('user',)
+    autocomplete_fields = ('style',)
+    readonly_fields = (
+        'final_prompt', 'lease_owner', 'lease_expires_at', 'heartbeat_at',
+        'attempts', 'quota_charged', 'processing_time', 'created_at', 'updated_at',
+    )
+
+
+@admin.register(APIUsage)
+class APIUsageAdmin(LargeTableAdmin):
+    list_display = ('user', 'endpoint', 'date', 'requests_count')
+    list_select_related = ('user',)
+    list_filter = ('date',)
+    search_fields = ('=user__username',)
+    ordering = ('-date',)
+    raw_id_fields = ('user',)
+
+
+@admin.register(UserFavorite)
+class UserFavoriteAdmin(LargeTableAdmin):
+    list_display = ('user', 'design', 'created_at')
+    # TattooDesign.__str__ reads the design's user and style
+    list_select_related = ('user', 'design__user', 'design__style')
+    search_fields = ('=user__username',)
+    raw_id_fields = ('user', 'design')
+
+
+@admin.register(Subscription)
+class SubscriptionAdmin(LargeTableAdmin):
+    list_display = ('user', 'plan', 'is_active', 'end_date')
+    list_select_related = ('user',)
+    list_filter = ('plan', 'is_active')
+    search_fields = ('=user__username',)
+    raw_id_fields = ('user',)
+
+
+@admin.register(APIUsageDailyRollup)
+class APIUsageDailyRollupAdmin(admin.ModelAdmin):
+    list_display = ('date', 'endpoint', 'requests_count', 'users_count')
+    list_filter = ('endpoint',)
+
+
+@admin.register(APIUsageMonthlyRollup)
+class APIUsageMonthlyRollupAdmin(LargeTableAdmin):
+    list_display = ('month', 'user', 'endpoint', 'requests_count')
+    list_select_related = ('user',)
+    search_fields = ('=user__username',)
+    raw_id_fields = ('user',)
+
+
+@admin.register(ImageBlob)
+class ImageBlobAdmin(LargeTableAdmin):
+    list_display = ('key', 'size', 'ref_count', 'created_at')
+    search_fields = ('=digest',)
+
+
+@admin.register(GenerationStatsBucket)
+class GenerationStatsBucketAdmin(admin.ModelAdmin):
+    list_display = ('hour', 'style', 'created_count', 'completed_count', 'failed_count', 'cancelled_count')
+    list_filter = ('style',)
+    list_select_related = ('style',)
+    date_hierarchy = 'hour'
+
 
-admin.site.register(User)
-admin.site.register(TattooStyle, TattooStyleAdmin) 
-admin.site.register(TattooDesign)
-admin.site.register(Subscription)
-admin.site.register(APIUsage)
-admin.site.register(UserFavorite)
+admin.site.register(RetentionCheckpoint)
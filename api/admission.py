@@ -0,0 +1,132 @@
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Count, Q
+from rest_framework import status
+from rest_framework.exceptions import APIException, Throttled
+
+from .models import TattooDesign
+
+
+class ServiceSaturated(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Tattoo generation is at capacity. Please try again shortly.'
+    default_code = 'service_saturated'
+
+    def __init__(self, wait, detail=None, code=None):
+        super().__init__(detail, code)
+        # DRF's exception handler turns `wait` into a Retry-After header
+        self.wait = wait
+
+
+class _LoadCache:
+    """
+    Per-process snapshot of generation load, refreshed at most every
+    ADMISSION_LOAD_CACHE_SECONDS so admission costs one indexed COUNT per
+    process per interval rather than one per request. Admissions made from
+    this process since the last refresh are added on top.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._expires = 0
+        self._load = None
+        self._avg_expires = 0
+        self._avg_seconds = None
+
+    def load(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._load is not None and now < self._expires:
+                return dict(self._load)
+
+        counts = TattooDesign.objects.filter(status__in=TattooDesign.ACTIVE_STATUSES).aggregate(
+            total=Count('id'),
+            queued=Count('id', filter=Q(lease_owner='')),
+        )
+        load = {'in_flight': counts['total'] - counts['queued'], 'queued': counts['queued']}
+        with self._lock:
+            self._load = load
+            self._expires = now + settings.ADMISSION_LOAD_CACHE_SECONDS
+        return dict(load)
+
+    def admitted(self):
+        with self._lock:
+            if self._load is not None:
+                self._load['queued'] += 1
+
+    def average_seconds(self):
+        """Mean processing time of recent completed generations."""
+        now = time.monotonic()
+        with self._lock:
+            if self._avg_seconds is not None and now < self._avg_expires:
+                return self._avg_seconds
+
+        values = list(
+            TattooDesign.objects.filter(status='completed', processing_time__isnull=False)
+            .order_by('-created_at').values_list('processing_time', flat=True)[:100]
+        )
+        average = sum(values) / len(values) if values else settings.GENERATION_DEFAULT_SECONDS
+        with self._lock:
+            self._avg_seconds = average
+            self._avg_expires = now + 60
+        return average
+
+
+load_cache = _LoadCache()
+
+
+def _limits():
+    capacity = settings.GENERATION_CAPACITY
+    free_limit = max(1, math.floor(capacity * settings.GENERATION_FREE_TIER_SHARE))
+    return capacity, free_limit
+
+
+def _retry_after(total, limit):
+    """
+    Seconds until enough running generations should have finished to bring
+    load under `limit`, assuming they drain in parallel at the recent
+    average processing time.
+    """
+    excess = total - limit + 1
+    if excess <= 0:
+        return 0
+    average = load_cache.average_seconds()
+    return max(1, math.ceil(average * excess / max(total, 1)))
+
+
+def load_status():
+    """Current load and whether each tier is being admitted, for the status endpoint."""
+    load = load_cache.load()
+    total = load['in_flight'] + load['queued']
+    capacity, free_limit = _limits()
+    return {
+        'in_flight': load['in_flight'],
+        'queued': load['queued'],
+        'capacity': capacity,
+        'accepting_free': total < free_limit,
+        'accepting_pro': total < capacity,
+        'retry_after': _retry_after(total, free_limit),
+    }
+
+
+def admit_generation(user):
+    """
+    Raises before any work is done when generation is saturated. Free-tier
+    traffic is shed first (429) once load passes its share of capacity;
+    everyone is turned away (503) at full capacity.
+    """
+    load = load_cache.load()
+    total = load['in_flight'] + load['queued']
+    capacity, free_limit = _limits()
+
+    if total >= capacity:
+        raise ServiceSaturated(wait=_retry_after(total, capacity))
+    if not user.is_pro and total >= free_limit:
+        raise Throttled(
+            wait=_retry_after(total, free_limit),
+            detail='Free-tier generation is busy right now. Please try again shortly, or upgrade to Pro.',
+        )
+    load_cache.admitted()
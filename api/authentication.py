@@ -0,0 +1,146 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.functional import cached_property
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import Subscription, User
+
+TOKEN_VERSION_CLAIM = 'ver'
+
+
+def subscription_tier(user):
+    """The user's active subscription plan, or 'free'."""
+    subscription = Subscription.objects.filter(user=user, is_active=True).values_list('plan', flat=True).first()
+    return subscription or 'free'
+
+
+def add_user_claims(token, user):
+    """
+    Stamps the claims ClaimsJWTAuthentication needs onto a token, so a
+    request can be authenticated without loading the User row.
+    """
+    token['username'] = user.username
+    token['is_pro'] = user.is_pro
+    token['tier'] = subscription_tier(user)
+    token[TOKEN_VERSION_CLAIM] = user.token_version
+    return token
+
+
+class _UserCache:
+    """
+    Per-process LRU cache of User rows with a short TTL, holding at most
+    AUTH_USER_CACHE_MAX_ENTRIES users. Other processes see a change (e.g. a
+    bumped token_version) once their entry expires.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        # Token claims carry the id as a string, model instances as an int.
+        key = str(user_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                return copy.copy(entry[1])
+
+        user = User.objects.get(pk=user_id)
+        with self._lock:
+            self._entries[key] = (now + settings.AUTH_USER_CACHE_SECONDS, user)
+            self._entries.move_to_end(key)
+            self._evict(now)
+        return copy.copy(user)
+
+    def _evict(self, now):
+        # Least recently used first: drop entries from the old end while
+        # they are expired or the cache is over its cap.
+        while self._entries:
+            expires, _ = next(iter(self._entries.values()))
+            if expires > now and len(self._entries) <= settings.AUTH_USER_CACHE_MAX_ENTRIES:
+                break
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+
+user_cache = _UserCache()
+
+
+def get_user_model_instance(user):
+    """
+    Returns a full User for `user`, which may be a ClaimsUser. Reads go
+    through the short-TTL cache; use `User.objects.get` before writing.
+    """
+    if isinstance(user, User):
+        return user
+    return user_cache.get(user.id)
+
+
+class ClaimsUser(TokenUser):
+    """
+    Lightweight request.user built from access token claims. It carries the
+    id, username, is_pro and subscription tier, which is all most endpoints
+    read. Use `get_user_model_instance()` where the full model is needed.
+    """
+
+    @cached_property
+    def is_pro(self):
+        return bool(self.token.get('is_pro', False))
+
+    @cached_property
+    def tier(self):
+        return self.token.get('tier', 'free')
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that trusts the token's claims instead of loading the
+    User on every request. The token's version claim is checked against the
+    user's token_version from the in-process cache, so each process still
+    reads a user's row once per AUTH_USER_CACHE_SECONDS, and tokens issued
+    before an is_pro change stop working within that time. A token newer
+    than the cached row means the cache is stale, so the row is re-read.
+
+    Tokens issued before claims were added fall back to the database lookup.
+    """
+
+    def get_user(self, validated_token):
+        if TOKEN_VERSION_CLAIM not in validated_token:
+            return super().get_user(validated_token)
+
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken('Token contained no recognizable user identification') from e
+
+        try:
+            user = user_cache.get(user_id)
+            if validated_token[TOKEN_VERSION_CLAIM] > user.token_version:
+                # Issued after our cached copy was read (e.g. by another
+                # worker); the cache is stale, not the token.
+                user_cache.invalidate(user_id)
+                user = user_cache.get(user_id)
+        except User.DoesNotExist as e:
+            raise AuthenticationFailed('User not found', code='user_not_found') from e
+
+        if not user.is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        if validated_token[TOKEN_VERSION_CLAIM] < user.token_version:
+            raise AuthenticationFailed(
+                'Token is out of date, please refresh it.', code='token_outdated'
+            )
+
+        return ClaimsUser(validated_token)
@@ -0,0 +1,35 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+
+def make_etag(*parts):
+    """A strong ETag from the given validator parts."""
+    digest = hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    # Always revalidate; the representation depends on who is asking.
+    response['Cache-Control'] = 'private, no-cache'
+    patch_vary_headers(response, ('Authorization', 'Accept'))
+    return response
+
+
+def respond_conditionally(request, etag, last_modified, render):
+    """
+    Answers If-None-Match with a 304 when the ETag matches, without calling
+    `render`. Otherwise returns `render()` with the validators attached.
+
+    If-Modified-Since is deliberately not honoured: HTTP dates have whole
+    second precision, so a status change in the same second as the previous
+    response would be answered with a 304. Last-Modified is informational.
+    """
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return set_validators(not_modified, etag, last_modified)
+    return set_validators(render(), etag, last_modified)
@@ -0,0 +1,91 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.permissions import SAFE_METHODS
+
+_read_from_replica = ContextVar('read_from_replica', default=False)
+
+PIN_CACHE_KEY = 'replica-pin:{}'
+
+
+class ReplicaRouter:
+    """
+    Sends reads to a random READ_REPLICAS alias, but only while a view has
+    opted in through ReplicaReadMixin. Everything else, including all
+    writes, migrations and background threads, uses the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if settings.READ_REPLICAS and _read_from_replica.get():
+            return random.choice(settings.READ_REPLICAS)
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+def pin_to_primary(user_id):
+    """Keeps a user's reads on the primary for a short while after they write."""
+    cache.set(PIN_CACHE_KEY.format(user_id), True, settings.REPLICA_PIN_SECONDS)
+
+
+def is_pinned_to_primary(user_id):
+    return bool(cache.get(PIN_CACHE_KEY.format(user_id)))
+
+
+class ReplicaReadMixin:
+    """
+    Lets a DRF view read from the replicas for safe requests. On viewsets,
+    only the actions in `replica_actions` do. Users who wrote something in
+    the last REPLICA_PIN_SECONDS keep reading from the primary, so they
+    always see their own writes.
+    """
+    replica_actions = ('list', 'retrieve')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self._replica_token = None
+        if request.method not in SAFE_METHODS:
+            return
+        action = getattr(self, 'action', None)
+        if action is not None and action not in self.replica_actions:
+            return
+        user = request.user
+        if user.is_authenticated and is_pinned_to_primary(user.id):
+            return
+        self._replica_token = _read_from_replica.set(True)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, '_replica_token', None)
+        if token is not None:
+            _read_from_replica.reset(token)
+            self._replica_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class ReplicaPinningMiddleware:
+    """
+    Pins the user to the primary after any successful unsafe request. DRF
+    sets request.user on the underlying request once it authenticates, so
+    the user is known here by the time the response comes back.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated:
+                pin_to_primary(user.id)
+        return response
@@ -0,0 +1,136 @@
+import json
+import os
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .storage import StorageError
+
+# Yield to the client once this much ZIP output has accumulated.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+EXPORT_FIELDS = ('id', 'prompt', 'style__name', 'style__display_name', 'generated_image', 'created_at')
+
+
+class _ZipStreamBuffer:
+    """
+    Write-only, unseekable sink for ZipFile. zipfile notices it cannot seek
+    and writes data descriptors instead, so the archive can be streamed out
+    while it is being built.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._size = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self, force=False):
+        if self._chunks and (force or self._size >= STREAM_CHUNK_SIZE):
+            data = b''.join(self._chunks)
+            self._chunks = []
+            self._size = 0
+            yield data
+
+
+def _entry_name(design):
+    extension = os.path.splitext(design['generated_image'])[1] or '.png'
+    return f"designs/{design['created_at']:%Y%m%d-%H%M%S}-{design['id']}{extension}"
+
+
+def _zip_info(name, when):
+    info = zipfile.ZipInfo(name, date_time=when.timetuple()[:6])
+    info.compress_type = zipfile.ZIP_STORED  # PNGs are already compressed
+    return info
+
+
+def _prefetch(designs, store, concurrency):
+    """
+    Yields `(design, image_bytes_or_None)` in order while fetching up to
+    `concurrency` images ahead, so at most that many are held in memory.
+    """
+    def fetch(key):
+        try:
+            return store.get(key)
+        except StorageError:
+            return None
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = deque()
+        for design in designs:
+            pending.append((design, pool.submit(fetch, design['generated_image'])))
+            if len(pending) >= concurrency:
+                design, future = pending.popleft()
+                yield design, future.result()
+        while pending:
+            design, future = pending.popleft()
+            yield design, future.result()
+
+
+def designs_after(queryset, design_id):
+    """
+    Narrows `queryset` to the designs that come after `design_id` in export
+    order. A client whose download broke off resumes by passing the id of
+    the last design it received intact. Returns None for an unknown id.
+    """
+    anchor = queryset.filter(pk=design_id).values('created_at', 'id').first()
+    if anchor is None:
+        return None
+    return queryset.filter(
+        Q(created_at__gt=anchor['created_at'])
+        | Q(created_at=anchor['created_at'], id__gt=anchor['id'])
+    )
+
+
+def stream_design_library(queryset, store, concurrency=None):
+    """
+    Generates a ZIP of the designs in `queryset` as a series of byte chunks.
+
+    The archive starts with manifest.json (prompt and style of each design,
+    in archive order) followed by one image per design. Both passes read
+    the queryset with `.iterator()`, and images are fetched with bounded
+    prefetch, so memory use does not grow with the size of the library.
+    """
+    concurrency = concurrency or settings.EXPORT_PREFETCH_CONCURRENCY
+    queryset = queryset.exclude(generated_image='').exclude(generated_image__isnull=True)
+    designs = queryset.order_by('created_at', 'id').values(*EXPORT_FIELDS)
+    buffer = _ZipStreamBuffer()
+    missing = []
+
+    with zipfile.ZipFile(buffer, mode='w', allowZip64=True) as archive:
+        with archive.open(_zip_info('manifest.json', timezone.now()), mode='w', force_zip64=True) as manifest:
+            manifest.write(b'[')
+            for i, design in enumerate(designs.iterator()):
+                entry = {
+                    'id': str(design['id']),
+                    'file': _entry_name(design),
+                    'prompt': design['prompt'],
+                    'style': design['style__name'],
+                    'style_display_name': design['style__display_name'],
+                    'created_at': design['created_at'].isoformat(),
+                }
+                manifest.write((b',' if i else b'') + json.dumps(entry).encode())
+                yield from buffer.drain()
+            manifest.write(b']')
+
+        for design, data in _prefetch(designs.iterator(), store, concurrency):
+            if data is None:
+                missing.append(str(design['id']))
+                continue
+            archive.writestr(_zip_info(_entry_name(design), design['created_at']), data)
+            yield from buffer.drain()
+
+        if missing:
+            archive.writestr(_zip_info('missing.json', timezone.now()), json.dumps(missing))
+
+    yield from buffer.drain(force=True)
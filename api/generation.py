@@ -0,0 +1,143 @@
+import base64
+import re
+import threading
+
+from django.conf import settings
+
+API_URL = "https://router.huggingface.co/hf-inference/models/black-forest-labs/FLUX.1-schnell"
+
+ASPECT_RATIO_PATTERN = re.compile(r'^\s*(\d+)\s*:\s*(\d+)')
+
+UPSTREAM_CHUNK_SIZE = 64 * 1024
+# How often a worker waiting on the API checks whether it should give up.
+ABORT_POLL_SECONDS = 0.5
+
+
+class UpstreamError(Exception):
+    """The inference API returned something other than an image."""
+
+
+class GenerationAborted(Exception):
+    """The design was cancelled, deleted or taken over while rendering."""
+
+
+def parse_aspect_ratio(value):
+    """
+    Parses the customize screen's aspect ratio label ("9:16 Portrait",
+    "1:1 Square", ...) into `(width, height)` parts. Returns None if the
+    label has no usable ratio.
+    """
+    match = ASPECT_RATIO_PATTERN.match(value or '')
+    if not match:
+        return None
+    width, height = int(match.group(1)), int(match.group(2))
+    if not width or not height or max(width, height) / min(width, height) > 4:
+        return None
+    return width, height
+
+
+def render_size(aspect_ratio, long_side):
+    """
+    Width and height for a render whose longer side is `long_side`, rounded
+    to the multiple of 64 the model expects. Defaults to square.
+    """
+    width, height = parse_aspect_ratio(aspect_ratio) or (1, 1)
+    scale = long_side / max(width, height)
+
+    def snap(n):
+        return max(64, int(round(n * scale / 64)) * 64)
+
+    return snap(width), snap(height)
+
+
+def render_parameters(aspect_ratio, preview=False, from_image=False):
+    """
+    Inference parameters for the cheap preview or the full render, on the
+    text-to-image model or, `from_image`, the image-to-image one. Their step
+    counts differ: the image-to-image model only runs about
+    SOURCE_IMAGE_STRENGTH of its steps.
+    """
+    if preview:
+        long_side = settings.PREVIEW_RENDER_SIZE
+        steps = settings.IMG2IMG_PREVIEW_INFERENCE_STEPS if from_image else settings.PREVIEW_INFERENCE_STEPS
+    else:
+        long_side = settings.FULL_RENDER_SIZE
+        steps = settings.IMG2IMG_FULL_INFERENCE_STEPS if from_image else settings.FULL_INFERENCE_STEPS
+    width, height = render_size(aspect_ratio, long_side)
+    return {'width': width, 'height': height, 'num_inference_steps': steps}
+
+
+def _read_image(response, abort=None):
+    print(f"[WORKER LOG] Hugging Face API responded with status: {response.status_code}")
+    if response.status_code != 200:
+        raise UpstreamError(f"Status: {response.status_code}, Text: {response.text}")
+    chunks = []
+    for chunk in response.iter_content(UPSTREAM_CHUNK_SIZE):
+        if abort is not None and abort.is_set():
+            # Stop downloading an image nobody wants any more.
+            response.close()
+            raise GenerationAborted()
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def _post(url, payload, abort=None):
+    """
+    POSTs to the inference API and returns the image bytes.
+
+    With an `abort` event, the request runs on a helper thread and the caller
+    stops waiting as soon as the event is set, raising GenerationAborted.
+    The helper then drops the response body instead of downloading it.
+    """
+    # Imported on first use, so web workers that never generate don't load it.
+    import requests
+
+    headers = {"Authorization": f"Bearer {settings.HF_API_TOKEN}"}
+
+    def call():
+        with requests.post(url, headers=headers, json=payload, timeout=settings.HF_REQUEST_TIMEOUT, stream=True) as response:
+            return _read_image(response, abort)
+
+    if abort is None:
+        return call()
+
+    done = threading.Event()
+    outcome = {}
+
+    def run():
+        try:
+            outcome['image'] = call()
+        except BaseException as e:
+            outcome['error'] = e
+        finally:
+            done.set()
+
+    threading.Thread(target=run, daemon=True).start()
+    while not done.wait(ABORT_POLL_SECONDS):
+        if abort.is_set():
+            raise GenerationAborted()
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['image']
+
+
+def text_to_image(prompt, parameters, abort=None):
+    """Calls the inference API and returns the image bytes."""
+    return _post(API_URL, {"inputs": prompt, "parameters": parameters}, abort)
+
+
+def image_to_image(prompt, image_bytes, parameters, abort=None):
+    """
+    Calls the image-to-image inference API with a preprocessed source photo
+    and returns the image bytes.
+    """
+    payload = {
+        "inputs": base64.b64encode(image_bytes).decode(),
+        "parameters": {
+            "prompt": prompt,
+            "target_size": {"width": parameters['width'], "height": parameters['height']},
+            "num_inference_steps": parameters['num_inference_steps'],
+            "strength": settings.SOURCE_IMAGE_STRENGTH,
+        },
+    }
+    return _post(settings.IMG2IMG_API_URL, payload, abort)
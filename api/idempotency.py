@@ -0,0 +1,107 @@
+import datetime
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.files import File
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+
+from .models import IdempotencyRecord
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyKeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = 'This Idempotency-Key was already used for a different request.'
+    default_code = 'idempotency_key_reused'
+
+
+class IdempotencyKeyInProgress(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'A request with this Idempotency-Key is still being processed. Retry shortly.'
+    default_code = 'idempotency_key_in_progress'
+
+    def __init__(self, wait, detail=None, code=None):
+        super().__init__(detail, code)
+        # DRF's exception handler turns `wait` into a Retry-After header
+        self.wait = wait
+
+
+def _encode_value(value):
+    if isinstance(value, File):
+        digest = hashlib.sha256()
+        for chunk in value.chunks():
+            digest.update(chunk)
+        value.seek(0)
+        return f'sha256:{digest.hexdigest()}'
+    return str(value)
+
+
+def request_fingerprint(request):
+    """SHA-256 over the method, path, query string and parsed body, uploads included."""
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    body = json.dumps(data, sort_keys=True, default=_encode_value)
+    return hashlib.sha256(f'{request.method} {request.get_full_path()}\n{body}'.encode()).hexdigest()
+
+
+def claim_key(user_id, key, fingerprint):
+    """
+    Returns `(record, True)` when this request should run and record its
+    outcome, or `(record, False)` when an earlier request with the same key
+    already completed. While another request holds the key, waits up to
+    IDEMPOTENCY_WAIT_SECONDS for it to finish.
+    """
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        now = timezone.now()
+        record = IdempotencyRecord.objects.filter(user_id=user_id, key=key).first()
+
+        if record is None or record.expires_at <= now:
+            if record is not None:
+                IdempotencyRecord.objects.filter(pk=record.pk, expires_at=record.expires_at).delete()
+            try:
+                with transaction.atomic():
+                    record = IdempotencyRecord.objects.create(
+                        user_id=user_id, key=key, fingerprint=fingerprint,
+                        expires_at=now + datetime.timedelta(seconds=settings.IDEMPOTENCY_PENDING_SECONDS),
+                    )
+                return record, True
+            except IntegrityError:
+                # A concurrent request claimed it first; look again.
+                continue
+
+        if record.fingerprint != fingerprint:
+            raise IdempotencyKeyReused()
+        if record.status == 'completed':
+            return record, False
+        if time.monotonic() >= deadline:
+            raise IdempotencyKeyInProgress(wait=1)
+        time.sleep(settings.IDEMPOTENCY_POLL_SECONDS)
+
+
+def complete_key(record, response):
+    """Stores the response for replay for IDEMPOTENCY_KEY_TTL_HOURS."""
+    IdempotencyRecord.objects.filter(pk=record.pk, status='pending').update(
+        status='completed',
+        response_status=response.status_code,
+        response_body=response.data,
+        expires_at=timezone.now() + datetime.timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS),
+    )
+
+
+def release_key(record):
+    """Frees the key after a request that had no lasting effect, so it can be retried."""
+    IdempotencyRecord.objects.filter(pk=record.pk, status='pending').delete()
+
+
+def replay_response(record):
+    return Response(record.response_body, status=record.response_status, headers={'Idempotent-Replayed': 'true'})
@@ -0,0 +1,119 @@
+import io
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+SOURCE_FORMATS = ('JPEG', 'PNG')
+
+
+class InvalidImage(Exception):
+    """The upload could not be turned into a model input."""
+
+
+def _preprocess(data, max_side, max_pixels, quality):
+    """
+    Runs in a pool process: decodes the upload, applies its EXIF orientation,
+    downscales it to fit `max_side`, flattens transparency onto white and
+    re-encodes it as a JPEG without any metadata.
+    """
+    from PIL import Image, ImageOps
+
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if image.format not in SOURCE_FORMATS:
+                raise InvalidImage('Upload a JPEG or PNG image.')
+            if image.width * image.height > max_pixels:
+                raise InvalidImage('Image is too large.')
+            # JPEGs can be decoded straight at a reduced scale.
+            image.draft('RGB', (max_side, max_side))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+            if image.mode in ('RGBA', 'LA', 'P'):
+                image = image.convert('RGBA')
+                flattened = Image.new('RGB', image.size, (255, 255, 255))
+                flattened.paste(image, mask=image.getchannel('A'))
+                image = flattened
+            elif image.mode != 'RGB':
+                image = image.convert('RGB')
+
+            output = io.BytesIO()
+            # No exif= or icc_profile=: the re-encoded file carries no metadata.
+            image.save(output, format='JPEG', quality=quality, optimize=True)
+            return output.getvalue()
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        raise InvalidImage('Upload a valid JPEG or PNG image.')
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: web workers run background threads that a
+            # forked child would inherit mid-flight.
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.IMAGE_PROCESS_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _pool
+
+
+def _discard_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def check_source_image(upload):
+    """
+    Cheap check of an upload in the request: reads only the image header
+    for its format and dimensions. Returns the format ('JPEG' or 'PNG');
+    raises InvalidImage.
+    """
+    from PIL import Image
+
+    try:
+        with Image.open(upload) as image:
+            image_format, (width, height) = image.format, image.size
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        raise InvalidImage('Upload a valid JPEG or PNG image.')
+    finally:
+        upload.seek(0)
+    if image_format not in SOURCE_FORMATS:
+        raise InvalidImage('Upload a JPEG or PNG image.')
+    if width * height > settings.SOURCE_IMAGE_MAX_PIXELS:
+        raise InvalidImage('Image is too large.')
+    return image_format
+
+
+def preprocess_source_image(data):
+    """
+    Normalizes a raw source photo for image-to-image generation in the
+    process pool, so decoding and resizing full-resolution phone photos
+    doesn't hold the GIL of the generation worker's process. Called from
+    the generation task, never from a request. Returns the JPEG bytes;
+    raises InvalidImage.
+    """
+    pool = _get_pool()
+    try:
+        future = pool.submit(
+            _preprocess, data,
+            settings.SOURCE_IMAGE_MAX_SIDE, settings.SOURCE_IMAGE_MAX_PIXELS, settings.SOURCE_IMAGE_QUALITY,
+        )
+        return future.result(timeout=settings.SOURCE_IMAGE_TIMEOUT)
+    except TimeoutError:
+        raise InvalidImage('Image took too long to process.')
+    except BrokenProcessPool:
+        # A pool process died (e.g. killed for memory); start a new pool next time.
+        _discard_pool(pool)
+        raise InvalidImage('Image could not be processed.')
@@ -0,0 +1,122 @@
+import datetime
+import os
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import TattooDesign
+
+
+def new_lease_owner():
+    """Identifies the process and thread running a generation."""
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def _lease_expiry(now):
+    return now + datetime.timedelta(seconds=settings.GENERATION_LEASE_SECONDS)
+
+
+def acquire_lease(design_id, owner):
+    """
+    Takes the lease on an active design if nobody holds a live one.
+    The check and the claim are a single UPDATE, so only one process wins.
+    """
+    now = timezone.now()
+    claimed = TattooDesign.objects.filter(
+        Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lt=now),
+        pk=design_id,
+        status__in=TattooDesign.ACTIVE_STATUSES,
+    ).update(
+        lease_owner=owner,
+        lease_expires_at=_lease_expiry(now),
+        heartbeat_at=now,
+        attempts=F('attempts') + 1,
+        updated_at=now,
+    )
+    return claimed == 1
+
+
+def renew_lease(design_id, owner):
+    """Extends a lease we still hold. Returns False if it was lost."""
+    now = timezone.now()
+    renewed = TattooDesign.objects.filter(
+        pk=design_id, lease_owner=owner, status__in=TattooDesign.ACTIVE_STATUSES
+    ).update(lease_expires_at=_lease_expiry(now), heartbeat_at=now)
+    return renewed == 1
+
+
+def lease_held(design_id, owner):
+    """Whether `owner` still holds the lease on a design that is still active."""
+    return TattooDesign.objects.filter(
+        pk=design_id, lease_owner=owner, status__in=TattooDesign.ACTIVE_STATUSES
+    ).exists()
+
+
+def finish_leased(design_id, owner, **fields):
+    """
+    Writes the final state of a design and drops the lease, but only if
+    `owner` still holds it. A worker whose lease expired and was handed to
+    someone else must not overwrite the newer attempt's result.
+    """
+    now = timezone.now()
+    return TattooDesign.objects.filter(pk=design_id, lease_owner=owner).update(
+        lease_owner='', lease_expires_at=None, heartbeat_at=now, updated_at=now, **fields
+    ) == 1
+
+
+def update_leased(design_id, owner, **fields):
+    """Writes intermediate state (e.g. a preview) while keeping the lease."""
+    return TattooDesign.objects.filter(pk=design_id, lease_owner=owner).update(
+        updated_at=timezone.now(), **fields
+    ) == 1
+
+
+class LeaseHeartbeat:
+    """
+    Renews a design's lease from a daemon thread while the generation runs.
+    Between renewals it checks every GENERATION_CANCEL_CHECK_SECONDS that the
+    lease is still held, so a cancelled or deleted design sets `lost` within
+    seconds and the worker can abandon it.
+
+        with LeaseHeartbeat(design_id, owner) as heartbeat:
+            ...
+            if heartbeat.lost.is_set(): ...
+    """
+
+    def __init__(self, design_id, owner, interval=None):
+        self.design_id = design_id
+        self.owner = owner
+        self.interval = interval or settings.GENERATION_HEARTBEAT_SECONDS
+        self.check_interval = min(self.interval, settings.GENERATION_CANCEL_CHECK_SECONDS)
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        try:
+            next_renewal = time.monotonic() + self.interval
+            while not self._stop.wait(self.check_interval):
+                if time.monotonic() >= next_renewal:
+                    held = renew_lease(self.design_id, self.owner)
+                    next_renewal = time.monotonic() + self.interval
+                else:
+                    held = lease_held(self.design_id, self.owner)
+                if not held:
+                    self.lost.set()
+                    return
+        finally:
+            connection.close()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        return False
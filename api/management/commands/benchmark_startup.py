@@ -0,0 +1,91 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.warmup import LAZY_MODULES, request_path, warm_up
+
+# Runs in a fresh interpreter, like a worker started without preloading.
+COLD_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import DeepTattooAI.wsgi
+imported = time.perf_counter()
+from api.warmup import LAZY_MODULES, request_path
+status = request_path(sys.argv[1])
+served = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'first_request_ms': (served - imported) * 1000,
+    'status': status,
+    'lazy_modules_loaded': [m for m in LAZY_MODULES if m in sys.modules],
+}))
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures web worker cold start: time to import the app and time to serve '
+        'the first request, for workers started cold and workers forked from a '
+        'preloaded, warmed-up master (as gunicorn.conf.py does).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=3, help='Workers to simulate in each mode.')
+        parser.add_argument('--path', default=None, help='Path of the first request (default: WARMUP_PATH).')
+
+    def handle(self, *args, **options):
+        path = options['path'] or settings.WARMUP_PATH
+        self.stdout.write(f"{'worker':<10}{'mode':<10}{'import':>10}{'first request':>16}{'status':>8}  lazy modules loaded")
+
+        for n in range(1, options['workers'] + 1):
+            self._report(n, 'cold', self._cold_worker(path))
+
+        warm_up(log=lambda message: None)
+        for n in range(1, options['workers'] + 1):
+            self._report(n, 'preload', self._forked_worker(path))
+
+    def _report(self, n, mode, result):
+        self.stdout.write(
+            f"{n:<10}{mode:<10}{result['import_ms']:>8.0f}ms{result['first_request_ms']:>14.0f}ms"
+            f"{result['status']:>8}  {', '.join(result['lazy_modules_loaded']) or '-'}"
+        )
+
+    def _cold_worker(self, path):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'DeepTattooAI.settings')}
+        output = subprocess.run(
+            [sys.executable, '-c', COLD_PROBE, path],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        return json.loads(output.strip().splitlines()[-1])
+
+    def _forked_worker(self, path):
+        """Forks from this (warmed-up) process and times the child's first request."""
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            status = 0
+            try:
+                start = time.perf_counter()
+                result = {
+                    'import_ms': 0.0,
+                    'status': request_path(path),
+                    'first_request_ms': (time.perf_counter() - start) * 1000,
+                    'lazy_modules_loaded': [m for m in LAZY_MODULES if m in sys.modules],
+                }
+                os.write(write_fd, json.dumps(result).encode())
+            except BaseException:
+                status = 1
+            finally:
+                os._exit(status)
+
+        os.close(write_fd)
+        with os.fdopen(read_fd) as pipe:
+            output = pipe.read()
+        os.waitpid(pid, 0)
+        return json.loads(output)
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from api.retention import delete_in_batches, expired_designs, expired_idempotency_records, expired_usage
+
+
+class Command(BaseCommand):
+    help = (
+        'Deletes rolled-up APIUsage rows past retention, failed or abandoned '
+        'TattooDesigns and expired idempotency keys, in small batches. Safe to '
+        'interrupt and re-run.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--pause', type=float, default=None, help='Seconds to sleep between batches.')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        targets = [
+            ('API usage rows', expired_usage()),
+            ('designs', expired_designs()),
+            ('idempotency keys', expired_idempotency_records()),
+        ]
+
+        for label, queryset in targets:
+            if options['dry_run']:
+                self.stdout.write(f"Would delete {queryset.count()} {label}.")
+                continue
+            deleted = delete_in_batches(
+                queryset,
+                batch_size=options['batch_size'],
+                pause=options['pause'],
+                log=self.stdout.write,
+            )
+            self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} {label}."))
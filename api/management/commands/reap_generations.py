@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.tasks import reap_expired_generations
+
+
+class Command(BaseCommand):
+    help = (
+        'Requeues processing designs whose generation lease expired, or fails them '
+        'and refunds quota once they run out of attempts.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop', type=int, default=0, metavar='SECONDS',
+            help='Keep running, reaping every SECONDS seconds.',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            requeued, failed = reap_expired_generations(log=self.stdout.write)
+            self.stdout.write(f"Requeued {requeued}, failed {failed} expired generation(s).")
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.retention import rollup_usage
+
+
+class Command(BaseCommand):
+    help = 'Rolls raw APIUsage rows up into daily and monthly totals. Resumes from the last rolled-up day.'
+
+    def handle(self, *args, **options):
+        days = rollup_usage(log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(f"Rolled up {days} day(s) of API usage."))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from api.retention import sweep_orphan_images
+from api.storage import get_blob_store
+
+
+class Command(BaseCommand):
+    help = (
+        'Deletes generated and source images in blob storage that no TattooDesign '
+        'references. Resumes from the last checkpointed key.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        scanned, removed = sweep_orphan_images(
+            get_blob_store(), dry_run=options['dry_run'], log=self.stdout.write
+        )
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(f"Scanned {scanned} objects. {verb} {removed} orphans."))
@@ -0,0 +1,73 @@
+import re
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+
+try:
+    import brotli
+except ImportError:  # in requirements.txt; without it responses fall back to gzip
+    brotli = None
+
+COMPRESSIBLE_TYPES = re.compile(r'^(text/|application/(json|javascript|xml)|image/svg)')
+
+
+def _accepts(request, encoding):
+    """Whether Accept-Encoding lists `encoding` without refusing it with q=0."""
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, _, params = item.partition(';')
+        if name.strip().lower() != encoding:
+            continue
+        quality = params.strip().lower()
+        if quality.startswith('q='):
+            try:
+                return float(quality[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+class CompressionMiddleware:
+    """
+    Compresses API responses of at least COMPRESSION_MIN_BYTES with brotli
+    when the client accepts it, otherwise gzip.
+    Streaming responses (ZIP exports, static files) and binary payloads are
+    left alone. Strong ETags are weakened, as Django's GZipMiddleware does,
+    so conditional requests still match.
+    """
+    # Same BREACH mitigation as Django's GZipMiddleware.
+    max_random_bytes = 100
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (
+            response.streaming
+            or response.has_header('Content-Encoding')
+            or len(response.content) < settings.COMPRESSION_MIN_BYTES
+            or not COMPRESSIBLE_TYPES.match(response.get('Content-Type', ''))
+        ):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if brotli is not None and _accepts(request, 'br'):
+            encoding = 'br'
+            compressed = brotli.compress(response.content, quality=settings.BROTLI_QUALITY)
+        elif _accepts(request, 'gzip'):
+            encoding = 'gzip'
+            compressed = compress_string(response.content, max_random_bytes=self.max_random_bytes)
+        else:
+            return response
+
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
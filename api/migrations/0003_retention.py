@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:07
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_remove_tattoostyle_created_at_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RetentionCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('cursor', models.CharField(blank=True, max_length=1024)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='apiusage',
+            name='date',
+            field=models.DateField(auto_now_add=True, db_index=True),
+        ),
+        migrations.CreateModel(
+            name='APIUsageDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('endpoint', models.CharField(max_length=100)),
+                ('date', models.DateField()),
+                ('requests_count', models.PositiveBigIntegerField(default=0)),
+                ('users_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-date', 'endpoint'],
+                'unique_together': {('endpoint', 'date')},
+            },
+        ),
+        migrations.CreateModel(
+            name='APIUsageMonthlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('endpoint', models.CharField(max_length=100)),
+                ('month', models.DateField()),
+                ('requests_count', models.PositiveBigIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-month', 'endpoint'],
+                'unique_together': {('user', 'endpoint', 'month')},
+            },
+        ),
+    ]
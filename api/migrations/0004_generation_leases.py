@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:08
+
+from django.db import migrations, models
+
+
+def backfill_final_prompts(apps, schema_editor):
+    # Designs already stuck in 'processing' are what the reaper will requeue;
+    # rebuild their prompt the way the view does (customizations weren't kept).
+    TattooDesign = apps.get_model('api', 'TattooDesign')
+    stuck = TattooDesign.objects.filter(status='processing', final_prompt='').select_related('style')
+    for design in stuck.iterator():
+        design.final_prompt = f"{design.style.display_name} style tattoo, {design.prompt}"
+        design.save(update_fields=['final_prompt'])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_retention'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tattoodesign',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tattoodesign',
+            name='final_prompt',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='tattoodesign',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tattoodesign',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tattoodesign',
+            name='lease_owner',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='tattoodesign',
+            name='quota_charged',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(backfill_final_prompts, migrations.RunPython.noop),
+    ]
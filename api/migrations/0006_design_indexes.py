@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_image_blobs'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='tattoodesign',
+            index=models.Index(fields=['status', '-created_at'], name='design_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tattoodesign',
+            index=models.Index(fields=['is_public', 'status', '-created_at'], name='design_public_created_idx'),
+        ),
+    ]
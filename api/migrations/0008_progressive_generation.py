@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_user_token_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tattoodesign',
+            name='aspect_ratio',
+            field=models.CharField(blank=True, max_length=30),
+        ),
+        migrations.AddField(
+            model_name='tattoodesign',
+            name='preview_image',
+            field=models.ImageField(blank=True, null=True, upload_to='generated_tattoos/'),
+        ),
+        migrations.AddField(
+            model_name='tattoodesign',
+            name='progressive',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='tattoodesign',
+            name='status',
+            field=models.CharField(choices=[('processing', 'Processing'), ('preview', 'Preview'), ('completed', 'Completed'), ('failed', 'Failed')], default='processing', max_length=20),
+        ),
+    ]
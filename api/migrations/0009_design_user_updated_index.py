@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_progressive_generation'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='tattoodesign',
+            index=models.Index(fields=['user', 'updated_at'], name='design_user_updated_idx'),
+        ),
+    ]
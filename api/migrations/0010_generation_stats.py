@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_design_user_updated_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationStatsBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('created_count', models.PositiveIntegerField(default=0)),
+                ('completed_count', models.PositiveIntegerField(default=0)),
+                ('failed_count', models.PositiveIntegerField(default=0)),
+                ('processing_time_total', models.FloatField(default=0)),
+                ('latency_sketch', models.JSONField(blank=True, default=dict)),
+                ('style', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.tattoostyle')),
+            ],
+            options={
+                'ordering': ['-hour', 'style'],
+                'unique_together': {('hour', 'style')},
+            },
+        ),
+    ]
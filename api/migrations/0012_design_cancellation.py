@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_idempotency_records'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationstatsbucket',
+            name='cancelled_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='tattoodesign',
+            name='status',
+            field=models.CharField(choices=[('processing', 'Processing'), ('preview', 'Preview'), ('completed', 'Completed'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], default='processing', max_length=20),
+        ),
+    ]
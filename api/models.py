@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import FileExtensionValidator
 import uuid
 
@@ -13,6 +14,8 @@ class User(AbstractUser):
     )
     is_pro = models.BooleanField(default=False)
     pro_subscription_date = models.DateTimeField(null=True, blank=True)
+    # Bumped whenever claims embedded in access tokens (e.g. is_pro) change
+    token_version = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -44,9 +47,13 @@ class TattooDesign(models.Model):
     """Generated tattoo designs"""
     STATUS_CHOICES = [
         ('processing', 'Processing'),
+        ('preview', 'Preview'),
         ('completed', 'Completed'),
         ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),
     ]
+    # Statuses of a design whose generation is still running
+    ACTIVE_STATUSES = ['processing', 'preview']
     
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='tattoo_designs')
@@ -62,11 +69,22 @@ class TattooDesign(models.Model):
     
     # Generated results
     generated_image = models.ImageField(upload_to='generated_tattoos/', null=True, blank=True)
+    preview_image = models.ImageField(upload_to='generated_tattoos/', null=True, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='processing')
     
     # AI processing details
     ai_model_used = models.CharField(max_length=100, blank=True)
     processing_time = models.FloatField(null=True, blank=True)  
+    final_prompt = models.TextField(blank=True)  # prompt actually sent to the model, kept for retries
+    aspect_ratio = models.CharField(max_length=30, blank=True)
+    progressive = models.BooleanField(default=False)  # render a quick preview before the full image
+
+    # Generation lease, so a job orphaned by a dead worker can be reaped
+    lease_owner = models.CharField(max_length=255, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    quota_charged = models.BooleanField(default=False)
     
     # User interaction
     is_favorite = models.BooleanField(default=False)
@@ -77,10 +95,29 @@ class TattooDesign(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Admin status filter, and the gallery's public + completed listing
+            models.Index(fields=['status', '-created_at'], name='design_status_created_idx'),
+            models.Index(fields=['is_public', 'status', '-created_at'], name='design_public_created_idx'),
+            # Per-user count/max(updated_at) validator for conditional list requests
+            models.Index(fields=['user', 'updated_at'], name='design_user_updated_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.style.display_name} - {self.created_at}"
 
+class ImageBlob(models.Model):
+    """Content-addressed stored image, shared by every design with the same bytes"""
+    digest = models.CharField(max_length=64, primary_key=True)  # SHA-256 hex
+    key = models.CharField(max_length=255, unique=True)
+    size = models.PositiveIntegerField()
+    content_type = models.CharField(max_length=100)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.key} ({self.ref_count} refs)"
+
 class Gallery(models.Model):
     """Public gallery of tattoo designs"""
     design = models.OneToOneField(TattooDesign, on_delete=models.CASCADE)
@@ -107,11 +144,84 @@ class APIUsage(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     endpoint = models.CharField(max_length=100)
     requests_count = models.PositiveIntegerField(default=0)
-    date = models.DateField(auto_now_add=True)
+    date = models.DateField(auto_now_add=True, db_index=True)
 
     class Meta:
         unique_together = ['user', 'endpoint', 'date']
 
+class APIUsageDailyRollup(models.Model):
+    """Per-endpoint daily totals, kept after raw APIUsage rows expire"""
+    endpoint = models.CharField(max_length=100)
+    date = models.DateField()
+    requests_count = models.PositiveBigIntegerField(default=0)
+    users_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ['endpoint', 'date']
+        ordering = ['-date', 'endpoint']
+
+class APIUsageMonthlyRollup(models.Model):
+    """Per-user monthly totals, kept after raw APIUsage rows expire"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    endpoint = models.CharField(max_length=100)
+    month = models.DateField()  # first day of the month
+    requests_count = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ['user', 'endpoint', 'month']
+        ordering = ['-month', 'endpoint']
+
+class RetentionCheckpoint(models.Model):
+    """Progress marker so retention commands can resume where they stopped"""
+    name = models.CharField(max_length=100, unique=True)
+    cursor = models.CharField(max_length=1024, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.cursor or '-'}"
+
+class GenerationStatsBucket(models.Model):
+    """Per-hour, per-style generation counters, updated as designs change status"""
+    hour = models.DateTimeField()  # start of the hour
+    style = models.ForeignKey(TattooStyle, on_delete=models.CASCADE)
+    created_count = models.PositiveIntegerField(default=0)
+    completed_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    cancelled_count = models.PositiveIntegerField(default=0)
+    processing_time_total = models.FloatField(default=0)
+    # Log-bucketed histogram of processing_time for completed designs (see api.stats)
+    latency_sketch = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        unique_together = ['hour', 'style']
+        ordering = ['-hour', 'style']
+
+    def __str__(self):
+        return f"{self.style_id} @ {self.hour:%Y-%m-%d %H:00}"
+
+class IdempotencyRecord(models.Model):
+    """Outcome of a request made with an Idempotency-Key, replayed on retries"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('completed', 'Completed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)  # SHA-256 of the request
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    # Pending records expire quickly so a key held by a dead worker frees up
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ['user', 'key']
+
+    def __str__(self):
+        return f"{self.user_id}:{self.key} ({self.status})"
+
 class Subscription(models.Model):
     """Pro subscription management"""
     PLAN_CHOICES = [
@@ -1,9 +1,12 @@
 from rest_framework import permissions
-from .models import APIUsage
+from django.db.models import F
+from .models import APIUsage, TattooDesign
+from .authentication import get_user_model_instance
 import datetime
 
 # Free users get 5 creations per day.
 FREE_TIER_LIMIT = 5
+QUOTA_ENDPOINT = '/api/designs/'
 
 class IsProUser(permissions.BasePermission):
     """
@@ -12,6 +15,16 @@ class IsProUser(permissions.BasePermission):
     def has_permission(self, request, view):
         return request.user and request.user.is_authenticated and request.user.is_pro
 
+class IsStaffUser(permissions.BasePermission):
+    """
+    Allows access only to staff. Access tokens don't carry is_staff, so
+    this checks the (cached) user row.
+    """
+    def has_permission(self, request, view):
+        if not request.user or not request.user.is_authenticated:
+            return False
+        return get_user_model_instance(request.user).is_staff
+
 class HasCreationQuota(permissions.BasePermission):
     """
     Allows access if the user is Pro OR if they are a free user
@@ -30,8 +43,26 @@ class HasCreationQuota(permissions.BasePermission):
         # Check usage for free users
         today = datetime.date.today()
         usage, created = APIUsage.objects.get_or_create(
-            user=request.user,
-            endpoint='/api/designs/',
+            user_id=request.user.id,
+            endpoint=QUOTA_ENDPOINT,
             date=today
         )
-        return usage.requests_count < FREE_TIER_LIMIT
\ No newline at end of file
+        return usage.requests_count < FREE_TIER_LIMIT
+
+def refund_creation_quota(design_id):
+    """
+    Gives a free user back the creation a design was charged for. Flipping
+    `quota_charged` first makes the refund happen at most once per design.
+    """
+    design = TattooDesign.objects.filter(pk=design_id, quota_charged=True).values('user_id', 'created_at').first()
+    if design is None:
+        return False
+    if not TattooDesign.objects.filter(pk=design_id, quota_charged=True).update(quota_charged=False):
+        return False
+    APIUsage.objects.filter(
+        user_id=design['user_id'],
+        endpoint=QUOTA_ENDPOINT,
+        date=design['created_at'].date(),
+        requests_count__gt=0,
+    ).update(requests_count=F('requests_count') - 1)
+    return True
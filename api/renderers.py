@@ -0,0 +1,35 @@
+import json
+
+import orjson
+from rest_framework import renderers
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class ORJSONRenderer(renderers.JSONRenderer):
+    """
+    JSONRenderer backed by orjson. Produces the same compact UTF-8 output;
+    anything orjson can't encode natively (Decimal, lazy strings, ...) goes
+    through DRF's own encoder.
+    """
+    encoder = JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return orjson.dumps(data, default=self.encoder.default)
+
+
+class ZipRenderer(renderers.BaseRenderer):
+    """
+    Lets clients send `Accept: application/zip` to endpoints that stream a
+    ZIP themselves. Error responses on those endpoints are rendered as JSON.
+    """
+    media_type = 'application/zip'
+    format = 'zip'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, bytes):
+            return data
+        return json.dumps(data).encode()
@@ -0,0 +1,236 @@
+import datetime
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+
+from .models import (
+    APIUsage, APIUsageDailyRollup, APIUsageMonthlyRollup,
+    IdempotencyRecord, ImageBlob, RetentionCheckpoint, TattooDesign,
+)
+from .storage import GENERATED_IMAGES_PREFIX, SOURCE_IMAGES_PREFIX, SOURCE_UPLOADS_PREFIX, blob_digest
+
+# Blob prefixes the orphan sweep lists, with the checkpoint each resumes from.
+SWEPT_PREFIXES = [
+    (GENERATED_IMAGES_PREFIX, 'orphan_sweep'),
+    (SOURCE_IMAGES_PREFIX, 'orphan_sweep_sources'),
+    (SOURCE_UPLOADS_PREFIX, 'orphan_sweep_uploads'),
+]
+DESIGN_IMAGE_FIELDS = ('generated_image', 'preview_image', 'source_image')
+
+
+def get_checkpoint(name):
+    checkpoint, _ = RetentionCheckpoint.objects.get_or_create(name=name)
+    return checkpoint
+
+
+def save_checkpoint(checkpoint, cursor):
+    checkpoint.cursor = cursor
+    checkpoint.save(update_fields=['cursor', 'updated_at'])
+
+
+def rollup_usage_day(day):
+    """
+    Folds one day of raw APIUsage rows into the daily and monthly rollups
+    and advances the checkpoint, all in a single transaction so a crash
+    never counts a day twice.
+    """
+    month = day.replace(day=1)
+    with transaction.atomic():
+        rows = APIUsage.objects.filter(date=day)
+
+        for row in rows.values('endpoint').annotate(
+            total=Sum('requests_count'), users=Count('user', distinct=True)
+        ):
+            APIUsageDailyRollup.objects.update_or_create(
+                endpoint=row['endpoint'],
+                date=day,
+                defaults={'requests_count': row['total'], 'users_count': row['users']},
+            )
+
+        for row in rows.values('user_id', 'endpoint').annotate(total=Sum('requests_count')):
+            rollup, _ = APIUsageMonthlyRollup.objects.get_or_create(
+                user_id=row['user_id'], endpoint=row['endpoint'], month=month
+            )
+            APIUsageMonthlyRollup.objects.filter(pk=rollup.pk).update(
+                requests_count=F('requests_count') + row['total']
+            )
+
+        save_checkpoint(get_checkpoint('usage_rollup'), day.isoformat())
+
+
+def rollup_usage(until=None, log=print):
+    """
+    Rolls up every day with usage after the last checkpoint, up to and
+    including `until` (yesterday by default). Returns the number of days.
+    """
+    until = until or (timezone.now().date() - datetime.timedelta(days=1))
+    checkpoint = get_checkpoint('usage_rollup')
+    last = datetime.date.fromisoformat(checkpoint.cursor) if checkpoint.cursor else datetime.date.min
+
+    days = 0
+    while True:
+        day = (
+            APIUsage.objects.filter(date__gt=last, date__lte=until)
+            .order_by('date').values_list('date', flat=True).first()
+        )
+        if day is None:
+            break
+        rollup_usage_day(day)
+        log(f"[RETENTION] Rolled up API usage for {day}")
+        last = day
+        days += 1
+    return days
+
+
+def delete_in_batches(queryset, batch_size=None, pause=None, log=print):
+    """
+    Deletes the rows matched by `queryset` a batch of primary keys at a
+    time, each batch in its own short transaction. Safe to interrupt and
+    re-run: the next run simply picks up the rows that are still left.
+    """
+    batch_size = batch_size or settings.RETENTION_BATCH_SIZE
+    pause = settings.RETENTION_BATCH_PAUSE if pause is None else pause
+    model = queryset.model
+    total = 0
+
+    while True:
+        pks = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            break
+        with transaction.atomic():
+            deleted, _ = model.objects.filter(pk__in=pks).delete()
+        total += len(pks)
+        log(f"[RETENTION] Deleted {len(pks)} {model._meta.verbose_name_plural} ({deleted} rows incl. cascades)")
+        if pause:
+            time.sleep(pause)
+
+    return total
+
+
+def expired_usage():
+    """Raw usage rows past the retention window that are already rolled up."""
+    cutoff = timezone.now().date() - datetime.timedelta(days=settings.USAGE_RETENTION_DAYS)
+    checkpoint = get_checkpoint('usage_rollup')
+    if not checkpoint.cursor:
+        return APIUsage.objects.none()
+    rolled_up_until = datetime.date.fromisoformat(checkpoint.cursor)
+    return APIUsage.objects.filter(date__lt=cutoff, date__lte=rolled_up_until)
+
+
+def expired_designs():
+    """Failed or cancelled designs past retention, and designs stuck mid-generation."""
+    now = timezone.now()
+    failed_cutoff = now - datetime.timedelta(days=settings.FAILED_DESIGN_RETENTION_DAYS)
+    abandoned_cutoff = now - datetime.timedelta(hours=settings.ABANDONED_DESIGN_RETENTION_HOURS)
+    return TattooDesign.objects.filter(
+        Q(status__in=['failed', 'cancelled'], updated_at__lt=failed_cutoff)
+        | Q(status__in=TattooDesign.ACTIVE_STATUSES, created_at__lt=abandoned_cutoff)
+    )
+
+
+def expired_idempotency_records():
+    """Idempotency keys past their TTL, and pending ones whose request died."""
+    return IdempotencyRecord.objects.filter(expires_at__lt=timezone.now())
+
+
+def _delete_orphans(store, keys):
+    """
+    Deletes the objects in `keys` that no one holds a reference on and
+    returns the keys actually deleted. Each object is only deleted while
+    its ImageBlob row is locked with ref_count=0, or, for objects without a
+    row, while a placeholder row for its digest is held, so a concurrent
+    store_blob can neither take a reference on it nor re-index it until the
+    object and the row are gone.
+    """
+    with transaction.atomic():
+        deletable = list(
+            ImageBlob.objects.select_for_update().filter(key__in=keys, ref_count=0).values_list('key', flat=True)
+        )
+        indexed = set(ImageBlob.objects.filter(key__in=keys).values_list('key', flat=True))
+        for key in keys:
+            if key in indexed:
+                continue
+            digest = blob_digest(key)
+            if digest is None:
+                # Not content-addressed, so store_blob can never reuse it.
+                deletable.append(key)
+                continue
+            try:
+                with transaction.atomic():
+                    ImageBlob.objects.create(digest=digest, key=key, size=0, content_type='', ref_count=0)
+            except IntegrityError:
+                # store_blob is indexing these bytes right now; leave them.
+                continue
+            deletable.append(key)
+
+        if deletable:
+            store.delete(deletable)
+            ImageBlob.objects.filter(key__in=deletable, ref_count=0).delete()
+    return deletable
+
+
+def sweep_orphan_images(store, dry_run=False, page_size=1000, log=print):
+    """
+    Lists the generated image and source photo prefixes page by page and deletes
+    objects that no ImageBlob holds a reference on, or, for legacy objects
+    that aren't content-addressed, that no TattooDesign image field points to. Objects younger than the grace period are
+    left alone, since a worker may have uploaded them but not saved the
+    design yet. The last listed key of each prefix is checkpointed so an
+    interrupted sweep resumes there.
+    """
+    scanned = removed = 0
+    for prefix, checkpoint_name in SWEPT_PREFIXES:
+        prefix_scanned, prefix_removed = _sweep_prefix(store, prefix, checkpoint_name, dry_run, page_size, log)
+        scanned += prefix_scanned
+        removed += prefix_removed
+    return scanned, removed
+
+
+def _sweep_prefix(store, prefix, checkpoint_name, dry_run, page_size, log):
+    checkpoint = get_checkpoint(checkpoint_name)
+    grace_cutoff = timezone.now() - datetime.timedelta(hours=settings.ORPHAN_IMAGE_GRACE_HOURS)
+    scanned = removed = 0
+
+    while True:
+        objects, truncated = store.list(prefix, start_after=checkpoint.cursor, limit=page_size)
+        if not objects:
+            break
+
+        keys = [obj['key'] for obj in objects]
+        # ImageBlob's ref_count is authoritative for content-addressed keys.
+        # The design image fields aren't indexed, so only the legacy keys,
+        # written before blobs existed, are looked up on TattooDesign.
+        referenced = set(
+            ImageBlob.objects.filter(key__in=keys, ref_count__gt=0).values_list('key', flat=True)
+        )
+        legacy_keys = [key for key in keys if blob_digest(key) is None]
+        if legacy_keys:
+            for field in DESIGN_IMAGE_FIELDS:
+                referenced.update(
+                    TattooDesign.objects.filter(**{f'{field}__in': legacy_keys}).values_list(field, flat=True)
+                )
+        orphans = [
+            obj['key'] for obj in objects
+            if obj['key'] not in referenced and obj['last_modified'] < grace_cutoff
+        ]
+
+        if orphans and not dry_run:
+            orphans = _delete_orphans(store, orphans)
+        scanned += len(keys)
+        removed += len(orphans)
+        log(f"[RETENTION] Scanned {len(keys)} objects under {prefix}, {len(orphans)} orphaned")
+
+        if not truncated:
+            break
+        if not dry_run:
+            save_checkpoint(checkpoint, keys[-1])
+        else:
+            checkpoint.cursor = keys[-1]
+
+    # Finished a full pass; the next run starts from the beginning again.
+    if not dry_run:
+        save_checkpoint(checkpoint, '')
+    return scanned, removed
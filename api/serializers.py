@@ -1,5 +1,69 @@
+from django.conf import settings
+from django.core.validators import FileExtensionValidator
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken
 from .models import User, TattooStyle, TattooDesign, UserFavorite, Subscription
+from .authentication import add_user_claims
+from .generation import parse_aspect_ratio
+from .images import InvalidImage, check_source_image
+
+
+def requested_fields(request):
+    """Field names from a `?fields=id,status` parameter, or None when absent."""
+    if request is None:
+        return None
+    value = request.query_params.get('fields')
+    if not value:
+        return None
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+class SparseFieldsetMixin:
+    """
+    Drops the fields not named in `?fields=` from the output. Fields listed
+    in `values_fields` map to a `.values()` lookup, so when only those are
+    requested, `serialize_values` can skip model instances altogether.
+    """
+    values_fields = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = requested_fields(self.context.get('request'))
+        if requested:
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+
+    @classmethod
+    def serialize_values(cls, queryset, context):
+        """
+        Serializes `queryset` with `.values()` when every requested field is
+        in `values_fields`. Returns None when the regular path is needed.
+        """
+        requested = requested_fields(context.get('request'))
+        if not requested or not requested <= set(cls.values_fields):
+            return None
+        fields = cls(context=context).fields
+        lookups = {name: cls.values_fields[name] for name in fields}
+        model = cls.Meta.model
+
+        def represent(name, field, value):
+            if value is None:
+                return None
+            if isinstance(field, serializers.FileField):
+                # Same output as FileField.to_representation, from the stored name.
+                if not value:
+                    return None
+                url = model._meta.get_field(lookups[name]).storage.url(value)
+                request = context.get('request')
+                return request.build_absolute_uri(url) if request is not None else url
+            return field.to_representation(value)
+
+        return [
+            {name: represent(name, field, row[lookups[name]]) for name, field in fields.items()}
+            for row in queryset.values(*lookups.values())
+        ]
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -41,35 +105,66 @@ class TattooDesignCreateSerializer(serializers.Serializer):
 
     # Optional fields from the "Customize" screen
     output_format = serializers.CharField(required=False) # e.g., "on arm", "on leg", "white background"
-    aspect_ratio = serializers.CharField(required=False) # e.g., "1:1 Square", "9:16 Portrait"
+    aspect_ratio = serializers.CharField(required=False, max_length=30) # e.g., "1:1 Square", "9:16 Portrait"
     gender = serializers.CharField(required=False) # e.g., "Male", "Female"
+    progressive = serializers.BooleanField(required=False) # quick low-res preview before the full render
+    # Photo to start from (image-to-image). Only its header is checked here;
+    # the generation task decodes and normalizes it in the process pool.
+    source_image = serializers.FileField(
+        required=False, validators=[FileExtensionValidator(allowed_extensions=['jpg', 'jpeg', 'png'])]
+    )
+
+    def validate_source_image(self, value):
+        if value.size > settings.SOURCE_IMAGE_MAX_UPLOAD_BYTES:
+            raise serializers.ValidationError('Image is too large.')
+        try:
+            value.image_format = check_source_image(value)
+        except InvalidImage as e:
+            raise serializers.ValidationError(str(e))
+        return value
+
+    def validate_aspect_ratio(self, value):
+        if parse_aspect_ratio(value) is None:
+            raise serializers.ValidationError('Expected a ratio such as "1:1 Square" or "9:16 Portrait".')
+        return value
 
     def create(self, validated_data):
       # The view will handle the actual object creation
       return validated_data
 
-class TattooDesignSerializer(serializers.ModelSerializer):
+class TattooDesignSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     style = TattooStyleSerializer(read_only=True)
     is_user_favorite = serializers.SerializerMethodField()
 
+    values_fields = {
+        'id': 'id', 'prompt': 'prompt', 'source_image': 'source_image',
+        'preview_image': 'preview_image', 'generated_image': 'generated_image',
+        'status': 'status', 'is_public': 'is_public', 'created_at': 'created_at',
+    }
+
     class Meta:
         model = TattooDesign
         fields = [
-            'id', 'prompt', 'style', 'source_image', 'generated_image',
+            'id', 'prompt', 'style', 'source_image', 'preview_image', 'generated_image',
             'status', 'is_public', 'created_at', 'is_user_favorite'
         ]
 
     def get_is_user_favorite(self, obj):
         user = self.context['request'].user
         if user.is_authenticated:
-            return UserFavorite.objects.filter(user=user, design=obj).exists()
+            return UserFavorite.objects.filter(user_id=user.id, design=obj).exists()
         return False
 
-class GalleryDesignSerializer(serializers.ModelSerializer):
+class GalleryDesignSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Serializer for the public gallery and search results."""
     style_name = serializers.CharField(source='style.display_name')
     user = serializers.CharField(source='user.username')
 
+    values_fields = {
+        'id': 'id', 'prompt': 'prompt', 'generated_image': 'generated_image',
+        'style_name': 'style__display_name', 'user': 'user__username',
+    }
+
     class Meta:
         model = TattooDesign
         fields = ['id', 'prompt', 'generated_image', 'style_name', 'user']
@@ -77,4 +172,25 @@ class GalleryDesignSerializer(serializers.ModelSerializer):
 class SubscriptionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Subscription
-        fields = ['plan', 'end_date', 'is_active']
\ No newline at end of file
+        fields = ['plan', 'end_date', 'is_active']
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """Issues token pairs carrying the claims used by ClaimsJWTAuthentication."""
+
+    @classmethod
+    def get_token(cls, user):
+        return add_user_claims(super().get_token(user), user)
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Re-reads the user when refreshing, so the new access token carries the
+    current is_pro, tier and token version rather than copies of the
+    refresh token's claims.
+    """
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        refresh = RefreshToken(data.get('refresh', attrs['refresh']))
+        user = User.objects.get(pk=refresh[jwt_settings.USER_ID_CLAIM])
+        data['access'] = str(add_user_claims(refresh.access_token, user))
+        return data
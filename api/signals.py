@@ -0,0 +1,38 @@
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .authentication import user_cache
+from .models import Subscription, TattooDesign, User
+from .storage import release_blob
+
+
+@receiver(post_delete, sender=TattooDesign)
+def release_design_images(sender, instance, **kwargs):
+    """Drops the design's references on its content-addressed images."""
+    release_blob(instance.generated_image.name)
+    release_blob(instance.preview_image.name)
+    release_blob(instance.source_image.name)
+
+
+@receiver(pre_save, sender=User)
+def bump_token_version(sender, instance, **kwargs):
+    """Invalidates issued access tokens when a claim they embed changes."""
+    update_fields = kwargs.get('update_fields')
+    if instance.pk is None or (update_fields is not None and 'is_pro' not in update_fields):
+        return
+    was_pro = User.objects.filter(pk=instance.pk).values_list('is_pro', flat=True).first()
+    if was_pro is not None and was_pro != instance.is_pro:
+        instance.token_version += 1
+
+
+@receiver(post_save, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    user_cache.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=Subscription)
+def bump_token_version_for_subscription(sender, instance, **kwargs):
+    """The subscription tier is also a token claim."""
+    User.objects.filter(pk=instance.user_id).update(token_version=F('token_version') + 1)
+    user_cache.invalidate(instance.user_id)
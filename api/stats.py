@@ -0,0 +1,131 @@
+import math
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import GenerationStatsBucket, TattooDesign
+
+# Latency sketches are log-bucketed histograms: bucket i counts processing
+# times in (GAMMA**(i-1), GAMMA**i]. Any quantile read back from a sketch is
+# within SKETCH_ACCURACY of the true value (relative), and two sketches
+# merge by adding their counts, so hours and styles can be combined freely.
+SKETCH_ACCURACY = 0.02
+GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+MIN_LATENCY = 0.001
+
+# Status a design moves to -> counter it increments
+TRANSITION_COUNTERS = {
+    'processing': 'created_count',
+    'completed': 'completed_count',
+    'failed': 'failed_count',
+    'cancelled': 'cancelled_count',
+}
+
+QUANTILES = {'p50': 0.5, 'p90': 0.9, 'p99': 0.99}
+
+
+def sketch_add(sketch, seconds):
+    index = math.ceil(math.log(max(seconds, MIN_LATENCY), GAMMA))
+    sketch[str(index)] = sketch.get(str(index), 0) + 1
+    return sketch
+
+
+def sketch_merge(sketch, other):
+    for index, count in other.items():
+        sketch[index] = sketch.get(index, 0) + count
+    return sketch
+
+
+def sketch_quantile(sketch, q):
+    total = sum(sketch.values())
+    if not total:
+        return None
+    rank = q * (total - 1)
+    seen = 0
+    for index in sorted(sketch, key=int):
+        seen += sketch[index]
+        if seen > rank:
+            return 2 * GAMMA ** int(index) / (GAMMA + 1)
+
+
+def record_transition(design_id, status, processing_time=None, style_id=None):
+    """
+    Counts a design moving to `status` in the bucket for the current hour
+    and the design's style. Completed designs also add their processing
+    time to the bucket's latency sketch.
+    """
+    counter = TRANSITION_COUNTERS.get(status)
+    if counter is None:
+        return
+    if style_id is None:
+        style_id = TattooDesign.objects.filter(pk=design_id).values_list('style_id', flat=True).first()
+        if style_id is None:
+            return
+    hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+
+    with transaction.atomic():
+        bucket, _ = GenerationStatsBucket.objects.select_for_update().get_or_create(hour=hour, style_id=style_id)
+        setattr(bucket, counter, getattr(bucket, counter) + 1)
+        update_fields = [counter]
+        if processing_time is not None:
+            bucket.processing_time_total += processing_time
+            sketch_add(bucket.latency_sketch, processing_time)
+            update_fields += ['processing_time_total', 'latency_sketch']
+        bucket.save(update_fields=update_fields)
+
+
+def _empty_summary():
+    return {'created': 0, 'completed': 0, 'failed': 0, 'cancelled': 0, 'processing_time_total': 0.0, 'sketch': {}}
+
+
+def _add_bucket(summary, bucket):
+    summary['created'] += bucket['created_count']
+    summary['completed'] += bucket['completed_count']
+    summary['failed'] += bucket['failed_count']
+    summary['cancelled'] += bucket['cancelled_count']
+    summary['processing_time_total'] += bucket['processing_time_total']
+    sketch_merge(summary['sketch'], bucket['latency_sketch'])
+
+
+def _finish_summary(summary):
+    finished = summary['completed'] + summary['failed']
+    sketch = summary.pop('sketch')
+    total_time = summary.pop('processing_time_total')
+    summary['failure_rate'] = summary['failed'] / finished if finished else None
+    summary['latency'] = {
+        'mean': total_time / summary['completed'] if summary['completed'] else None,
+        **{name: sketch_quantile(sketch, q) for name, q in QUANTILES.items()},
+    }
+    return summary
+
+
+def generation_stats(since, style=None):
+    """
+    Totals, per-style and per-hour summaries of the buckets from `since`
+    on. Reads at most one row per hour and style, whatever the number of
+    designs behind them.
+    """
+    buckets = GenerationStatsBucket.objects.filter(hour__gte=since)
+    if style:
+        buckets = buckets.filter(style__name=style)
+
+    totals = _empty_summary()
+    styles = {}
+    hours = {}
+    for bucket in buckets.values(
+        'hour', 'style__name', 'created_count', 'completed_count', 'failed_count', 'cancelled_count',
+        'processing_time_total', 'latency_sketch',
+    ):
+        _add_bucket(totals, bucket)
+        _add_bucket(styles.setdefault(bucket['style__name'], _empty_summary()), bucket)
+        _add_bucket(hours.setdefault(bucket['hour'], _empty_summary()), bucket)
+
+    return {
+        'since': since,
+        'totals': _finish_summary(totals),
+        'styles': {name: _finish_summary(summary) for name, summary in sorted(styles.items())},
+        'hours': [
+            {'hour': hour, **_finish_summary(summary)}
+            for hour, summary in sorted(hours.items())
+        ],
+    }
@@ -0,0 +1,254 @@
+import abc
+import datetime
+import hashlib
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import ImageBlob
+
+GENERATED_IMAGES_PREFIX = 'generated_tattoos/'
+SOURCE_IMAGES_PREFIX = 'source_images/'
+# Raw source photos, until the generation task has preprocessed them
+SOURCE_UPLOADS_PREFIX = 'source_uploads/'
+
+
+class StorageError(Exception):
+    """Raised by a BlobStore when the backend fails to read or write."""
+
+
+def get_r2_client():
+    """
+    Returns a boto3 S3 client pointed at Cloudflare R2, plus the bucket name.
+    Credentials are read directly from the environment.
+    """
+    # Imported on first use: boto3 is slow to import and most web requests never touch R2.
+    import boto3
+    from botocore.client import Config
+
+    account_id = os.environ.get('CLOUDFLARE_ACCOUNT_ID')
+    access_key_id = os.environ.get('CLOUDFLARE_ACCESS_KEY_ID')
+    secret_access_key = os.environ.get('CLOUDFLARE_SECRET_ACCESS_KEY')
+    bucket_name = os.environ.get('CLOUDFLARE_BUCKET_NAME')
+
+    if not all([account_id, access_key_id, secret_access_key, bucket_name]):
+        raise Exception("Cloudflare R2 credentials are missing in the environment.")
+
+    s3_client = boto3.client(
+        service_name="s3",
+        endpoint_url=f"https://{account_id}.r2.cloudflarestorage.com",
+        aws_access_key_id=access_key_id,
+        aws_secret_access_key=secret_access_key,
+        config=Config(signature_version="s3v4"),
+        region_name="auto",
+    )
+    return s3_client, bucket_name
+
+
+class BlobStore(abc.ABC):
+    """
+    The handful of object-store operations the app needs. Keys are
+    bucket-relative paths like the names stored in ImageFields.
+
+    `list` returns one page of `{'key', 'last_modified', 'size'}` dicts in
+    key order, starting after `start_after`, plus whether more pages follow.
+
+    There is deliberately no `exists`: an object without an ImageBlob row
+    may be an orphan a sweep is about to delete, so store_blob never trusts
+    one it finds.
+    """
+
+    @abc.abstractmethod
+    def put(self, key, data, content_type):
+        """Writes `data` under `key`, replacing any existing object."""
+
+    @abc.abstractmethod
+    def get(self, key):
+        """Returns the object's bytes."""
+
+    @abc.abstractmethod
+    def delete(self, keys):
+        """Deletes the objects; keys that don't exist are ignored."""
+
+    @abc.abstractmethod
+    def list(self, prefix, start_after='', limit=1000):
+        """Returns one page of objects under `prefix`, as described above."""
+
+
+class R2BlobStore(BlobStore):
+    """Cloudflare R2 (S3 API) backend."""
+
+    def __init__(self):
+        from botocore.exceptions import ClientError
+
+        self.client, self.bucket = get_r2_client()
+        self.ClientError = ClientError
+
+    def put(self, key, data, content_type):
+        try:
+            # We use `upload_fileobj` because we have bytes in memory, not a local file
+            self.client.upload_fileobj(
+                Fileobj=BytesIO(data),
+                Bucket=self.bucket,
+                Key=key,
+                ExtraArgs={'ContentType': content_type},
+            )
+        except self.ClientError as e:
+            raise StorageError(str(e)) from e
+
+    def get(self, key):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+        except self.ClientError as e:
+            raise StorageError(str(e)) from e
+
+    def delete(self, keys):
+        keys = list(keys)
+        try:
+            # delete_objects accepts at most 1000 keys per call
+            for i in range(0, len(keys), 1000):
+                self.client.delete_objects(
+                    Bucket=self.bucket,
+                    Delete={'Objects': [{'Key': key} for key in keys[i:i + 1000]], 'Quiet': True},
+                )
+        except self.ClientError as e:
+            raise StorageError(str(e)) from e
+
+    def list(self, prefix, start_after='', limit=1000):
+        params = {'Bucket': self.bucket, 'Prefix': prefix, 'MaxKeys': limit}
+        if start_after:
+            params['StartAfter'] = start_after
+        try:
+            page = self.client.list_objects_v2(**params)
+        except self.ClientError as e:
+            raise StorageError(str(e)) from e
+        objects = [
+            {'key': obj['Key'], 'last_modified': obj['LastModified'], 'size': obj['Size']}
+            for obj in page.get('Contents', [])
+        ]
+        return objects, bool(page.get('IsTruncated'))
+
+
+class LocalBlobStore(BlobStore):
+    """Filesystem backend rooted at MEDIA_ROOT, for development and tests."""
+
+    def __init__(self, root=None):
+        self.root = os.fspath(root or settings.MEDIA_ROOT)
+
+    def _path(self, key):
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise StorageError(f"Key escapes the storage root: {key}")
+        return path
+
+    def put(self, key, data, content_type):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename, so readers never see a half-written file.
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            raise StorageError(str(e)) from e
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except OSError as e:
+            raise StorageError(str(e)) from e
+
+    def delete(self, keys):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                raise StorageError(str(e)) from e
+
+    def list(self, prefix, start_after='', limit=1000):
+        keys = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                key = os.path.relpath(os.path.join(dirpath, filename), self.root).replace(os.sep, '/')
+                if key.startswith(prefix) and key > start_after and not key.endswith('.tmp'):
+                    keys.append(key)
+        keys.sort()
+        objects = []
+        for key in keys[:limit]:
+            stat = os.stat(self._path(key))
+            objects.append({
+                'key': key,
+                'last_modified': datetime.datetime.fromtimestamp(stat.st_mtime, tz=datetime.timezone.utc),
+                'size': stat.st_size,
+            })
+        return objects, len(keys) > limit
+
+
+_blob_store = None
+
+
+def get_blob_store():
+    """Returns the process-wide BlobStore selected by BLOB_STORAGE_BACKEND."""
+    global _blob_store
+    if _blob_store is None:
+        if settings.BLOB_STORAGE_BACKEND == 'r2':
+            _blob_store = R2BlobStore()
+        elif settings.BLOB_STORAGE_BACKEND == 'local':
+            _blob_store = LocalBlobStore()
+        else:
+            raise ValueError(f"Unknown BLOB_STORAGE_BACKEND: {settings.BLOB_STORAGE_BACKEND!r}")
+    return _blob_store
+
+
+def store_blob(data, content_type='image/png', extension='png', prefix=GENERATED_IMAGES_PREFIX, store=None):
+    """
+    Stores `data` under a key derived from its SHA-256 and takes a reference
+    on it. Returns the key, to be saved in an ImageField.
+
+    Identical bytes are uploaded once: if the ImageBlob index already knows
+    the digest, the upload is skipped. Otherwise the index row is created
+    and the object uploaded in one transaction, so the row never commits
+    without the object, and the orphan sweeper (which locks rows, or inserts
+    placeholders, before deleting objects) can't delete it underneath us.
+    An object that exists without a row is uploaded again rather than
+    trusted, since it may be an orphan a sweep is about to delete.
+    """
+    store = store or get_blob_store()
+    digest = hashlib.sha256(data).hexdigest()
+    key = f"{prefix}{digest[:2]}/{digest}.{extension}"
+
+    while True:
+        # Known blob: just take another reference.
+        if ImageBlob.objects.filter(digest=digest).update(ref_count=F('ref_count') + 1):
+            return ImageBlob.objects.values_list('key', flat=True).get(digest=digest)
+        try:
+            with transaction.atomic():
+                ImageBlob.objects.create(
+                    digest=digest, key=key, size=len(data), content_type=content_type, ref_count=1
+                )
+                store.put(key, data, content_type)
+            return key
+        except IntegrityError:
+            # Another worker (or a sweep) holds a row for these bytes; look again.
+            continue
+
+
+def blob_digest(key):
+    """The SHA-256 a content-addressed key was stored under, or None for other keys."""
+    name = os.path.splitext(os.path.basename(key))[0]
+    if len(name) == 64 and all(c in '0123456789abcdef' for c in name):
+        return name
+    return None
+
+
+def release_blob(key):
+    """Drops one reference to a content-addressed blob. Unknown keys are ignored."""
+    if key:
+        ImageBlob.objects.filter(key=key, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
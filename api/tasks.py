@@ -1,99 +1,227 @@
-import boto3
-from botocore.client import Config
-from botocore.exceptions import ClientError
 from django.conf import settings
 from django.core.files.base import ContentFile
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
 from .models import TattooDesign
-import requests
+from .leases import LeaseHeartbeat, acquire_lease, finish_leased, lease_held, new_lease_owner, update_leased
+from .images import InvalidImage, preprocess_source_image
+from .generation import GenerationAborted, UpstreamError, image_to_image, render_parameters, text_to_image
+from .permissions import refund_creation_quota
+from .stats import record_transition
+from .storage import (
+    SOURCE_IMAGES_PREFIX, SOURCE_UPLOADS_PREFIX, StorageError, get_blob_store, release_blob, store_blob,
+)
+import datetime
+import threading
 import time
-import os
 
-HF_API_TOKEN = os.environ.get("HF_API_TOKEN")
-API_URL = "https://router.huggingface.co/hf-inference/models/black-forest-labs/FLUX.1-schnell"
+def dispatch_generation(design_id, lease_owner=None):
+    """
+    Runs the generation for a design on a background thread. If the caller
+    already holds the design's lease (the reaper does), pass it along.
+    """
+    task_thread = threading.Thread(
+        target=generate_tattoo_from_prompt,
+        args=(design_id,),
+        kwargs={'lease_owner': lease_owner},
+    )
+    task_thread.start()
+    return task_thread
+
+def fail_generation(design_id, lease_owner):
+    """Marks a leased design as failed and refunds the free-tier quota it used."""
+    if finish_leased(design_id, lease_owner, status='failed'):
+        refund_creation_quota(design_id)
+        record_transition(design_id, 'failed')
+
+def cancel_generation(design_id):
+    """
+    Cancels a design that is still generating. Clearing the lease makes a
+    running worker abandon it at its next check, without uploading anything,
+    and queued or requeued work skips it because only active designs can be
+    leased. Returns False if the design had already finished.
+
+    The free-tier quota is refunded only if nothing was delivered yet; a
+    design cancelled after its preview was published keeps the charge, as
+    the user keeps the preview.
+    """
+    fields = {'status': 'cancelled', 'lease_owner': '', 'lease_expires_at': None, 'updated_at': timezone.now()}
+    # Each update only matches one status, so a preview published concurrently
+    # is either seen here or rejected by the worker's lease check.
+    if TattooDesign.objects.filter(pk=design_id, status='processing').update(**fields):
+        refund_creation_quota(design_id)
+    elif not TattooDesign.objects.filter(pk=design_id, status='preview').update(**fields):
+        return False
+    record_transition(design_id, 'cancelled')
+    return True
 
-def generate_tattoo_from_prompt(design_id, final_prompt):
+def _prepare_source(design, lease_owner):
     """
-    Background task that now MANUALLY handles the upload to Cloudflare R2,
-    bypassing django-storages for the upload step.
+    Returns the model-ready source photo. The first attempt to get here
+    preprocesses the raw upload in the process pool, stores the result in
+    its place and releases the raw upload.
+    """
+    name = design.source_image.name
+    data = get_blob_store().get(name)
+    if not name.startswith(SOURCE_UPLOADS_PREFIX):
+        return data
+
+    print(f"[WORKER LOG] Preprocessing {len(data)}-byte source photo...")
+    processed = preprocess_source_image(data)
+    processed_name = store_blob(processed, content_type='image/jpeg', extension='jpg', prefix=SOURCE_IMAGES_PREFIX)
+    if not update_leased(design.pk, lease_owner, source_image=processed_name):
+        release_blob(processed_name)
+        raise GenerationAborted()
+    release_blob(name)
+    print(f"[WORKER LOG] Source photo reduced to {len(processed)} bytes.")
+    return processed
+
+def _render_and_store(design, final_prompt, source_bytes=None, preview=False, abort=None):
+    """
+    Renders one phase, from the source photo when there is one, and stores
+    the image. Returns its storage key. Raises GenerationAborted, without
+    storing anything, once `abort` is set.
+    """
+    parameters = render_parameters(design.aspect_ratio, preview=preview, from_image=source_bytes is not None)
+    phase = 'preview' if preview else 'full render'
+    print(f"[WORKER LOG] Calling Hugging Face API for {phase} {parameters} (attempt {design.attempts})...")
+    if source_bytes is not None:
+        image_bytes = image_to_image(final_prompt, source_bytes, parameters, abort=abort)
+    else:
+        image_bytes = text_to_image(final_prompt, parameters, abort=abort)
+    print(f"[WORKER LOG] Received {len(image_bytes)} bytes from AI model.")
+    if abort is not None and abort.is_set():
+        raise GenerationAborted()
+
+    # Store the image under its content hash; identical bytes are
+    # uploaded once and shared between designs.
+    object_name = store_blob(image_bytes, content_type='image/png', extension='png')
+    print(f"[WORKER LOG] ✅ Stored {phase} as '{object_name}'.")
+    return object_name
+
+def generate_tattoo_from_prompt(design_id, final_prompt=None, lease_owner=None):
+    """
+    Background task that generates the image and writes it through the
+    content-addressed blob store, bypassing django-storages for the upload.
+
+    Progressive designs first get a cheap low-resolution preview, published
+    with status 'preview'; the full render only runs if the design is still
+    wanted afterwards.
+
+    The task holds a lease on the design for as long as it runs, renewed by a
+    heartbeat, so `reap_generations` can recover it if this worker dies.
     """
     print(f"--- [WORKER LOG] Starting task for design ID: {design_id} ---")
 
+    if lease_owner is None:
+        lease_owner = new_lease_owner()
+        if not acquire_lease(design_id, lease_owner):
+            print(f"[WORKER LOG] Design {design_id} is not active or is leased by another worker. Skipping.")
+            return
+
     try:
         design = TattooDesign.objects.get(id=design_id)
-        
-        print("[WORKER LOG] Calling Hugging Face API...")
-        headers = {"Authorization": f"Bearer {settings.HF_API_TOKEN}"}
-        response = requests.post(API_URL, headers=headers, json={"inputs": final_prompt})
-        print(f"[WORKER LOG] Hugging Face API responded with status: {response.status_code}")
-
-        if response.status_code != 200:
-            print(f"[WORKER LOG] 🔴 AI Model failed. Status: {response.status_code}, Text: {response.text}")
-            design.status = 'failed'
-            design.save()
+        final_prompt = final_prompt or design.final_prompt
+        if not final_prompt.strip():
+            print(f"[WORKER LOG] 🔴 Design {design_id} has no prompt to send. Failing it.")
+            fail_generation(design_id, lease_owner)
             return
 
-        image_bytes = response.content
-        print(f"[WORKER LOG] Received {len(image_bytes)} bytes from AI model.")
-
-        # --- MANUAL R2 UPLOAD LOGIC STARTS HERE ---
-        print("[WORKER LOG] Starting manual upload process to R2...")
-
-        # 1. Get credentials directly from the environment
-        account_id = os.environ.get('CLOUDFLARE_ACCOUNT_ID')
-        access_key_id = os.environ.get('CLOUDFLARE_ACCESS_KEY_ID')
-        secret_access_key = os.environ.get('CLOUDFLARE_SECRET_ACCESS_KEY')
-        bucket_name = os.environ.get('CLOUDFLARE_BUCKET_NAME')
-
-        if not all([account_id, access_key_id, secret_access_key, bucket_name]):
-            raise Exception("Cloudflare R2 credentials are missing in the environment.")
-
-        # 2. Initialize the boto3 client
-        s3_client = boto3.client(
-            service_name="s3",
-            endpoint_url=f"https://{account_id}.r2.cloudflarestorage.com",
-            aws_access_key_id=access_key_id,
-            aws_secret_access_key=secret_access_key,
-            config=Config(signature_version="s3v4"),
-            region_name="auto",
+        with LeaseHeartbeat(design_id, lease_owner) as heartbeat:
+            try:
+                source_bytes = None
+                if design.source_image:
+                    source_bytes = _prepare_source(design, lease_owner)
+
+                # A requeued attempt keeps the preview an earlier attempt published.
+                if design.progressive and not design.preview_image:
+                    preview_name = _render_and_store(
+                        design, final_prompt, source_bytes, preview=True, abort=heartbeat.lost,
+                    )
+                    if not update_leased(design_id, lease_owner, status='preview', preview_image=preview_name):
+                        print(f"[WORKER LOG] Design {design_id} is gone or was taken over; dropping preview.")
+                        release_blob(preview_name)
+                        return
+
+                    # Give the user a moment with the preview, and skip the
+                    # expensive render if they cancel or discard the design meanwhile.
+                    heartbeat.lost.wait(settings.PREVIEW_HOLD_SECONDS)
+                    if not lease_held(design_id, lease_owner):
+                        print(f"[WORKER LOG] Design {design_id} was discarded after preview. Skipping full render.")
+                        return
+
+                # processing_time covers the full render only, not the preview or the hold.
+                started = time.monotonic()
+                object_name = _render_and_store(design, final_prompt, source_bytes, abort=heartbeat.lost)
+
+            except GenerationAborted:
+                print(f"[WORKER LOG] Design {design_id} was cancelled, deleted or taken over. Stopping.")
+                return
+            except InvalidImage as e:
+                print(f"[WORKER LOG] 🔴 Source photo could not be processed. {e}")
+                fail_generation(design_id, lease_owner)
+                return
+            except UpstreamError as e:
+                print(f"[WORKER LOG] 🔴 AI Model failed. {e}")
+                fail_generation(design_id, lease_owner)
+                return
+            except StorageError as e:
+                print(f"[WORKER LOG] 🔴 IMAGE UPLOAD FAILED: {e}")
+                fail_generation(design_id, lease_owner)
+                return
+
+        # Save the final state and release the lease. We only set the text
+        # path of the image field, the file itself is already stored.
+        print("[WORKER LOG] Saving final design status to database: 'completed'")
+        processing_time = time.monotonic() - started
+        saved = finish_leased(
+            design_id, lease_owner,
+            status='completed',
+            generated_image=object_name,
+            processing_time=processing_time,
         )
-        print("[WORKER LOG]   boto3 client initialized.")
-
-        # 3. Define the object name (the full path in the bucket)
-        object_name = f"generated_tattoos/{design_id}.png"
-        
-        # 4. Upload the image bytes directly from memory
-        try:
-            # We use `upload_fileobj` because we have bytes in memory, not a local file
-            from io import BytesIO
-            s3_client.upload_fileobj(
-                Fileobj=BytesIO(image_bytes),
-                Bucket=bucket_name,
-                Key=object_name,
-                ExtraArgs={'ContentType': 'image/png'} # Important to set the content type
-            )
-            print(f"[WORKER LOG] ✅ Successfully uploaded to R2 as '{object_name}'.")
-
-            # 5. Update the Django model field MANUALLY
-            # We are not using .save() on the field, we are just setting the text path.
-            design.generated_image.name = object_name
-            design.status = 'completed'
-
-        except ClientError as e:
-            print(f"[WORKER LOG] 🔴 R2 UPLOAD FAILED with ClientError: {e}")
-            design.status = 'failed'
-
-        # --- MANUAL R2 UPLOAD LOGIC ENDS HERE ---
-
-        # Save the final state of the design object to the database
-        print(f"[WORKER LOG] Saving final design status to database: '{design.status}'")
-        design.save()
+        if saved:
+            record_transition(design_id, 'completed', processing_time, style_id=design.style_id)
+        else:
+            print(f"[WORKER LOG] Lease on design {design_id} was lost; leaving the result to the newer attempt.")
+            release_blob(object_name)
         print(f"--- [WORKER LOG] Task for design ID {design_id} finished. ---")
 
     except Exception as e:
         print(f"[WORKER LOG] 🔴 An unexpected exception occurred in the task: {e}")
-        try:
-            design_fail = TattooDesign.objects.get(id=design_id)
-            design_fail.status = 'failed'
-            design_fail.save()
-        except TattooDesign.DoesNotExist:
-            pass
\ No newline at end of file
+        fail_generation(design_id, lease_owner)
+
+    finally:
+        connection.close()
+
+def reap_expired_generations(log=print):
+    """
+    Finds active designs whose lease expired (the worker died or was
+    recycled) or that were never picked up, and either requeues them under
+    a fresh lease or, once they are out of attempts, fails them and refunds
+    the quota. Any process can run this; acquiring the lease is atomic, so
+    two reapers never requeue the same design.
+    """
+    now = timezone.now()
+    stale_cutoff = now - datetime.timedelta(seconds=settings.GENERATION_LEASE_SECONDS)
+    candidates = TattooDesign.objects.filter(
+        Q(lease_expires_at__lt=now)
+        | Q(lease_expires_at__isnull=True, created_at__lt=stale_cutoff),
+        status__in=TattooDesign.ACTIVE_STATUSES,
+    ).values_list('id', 'attempts')
+
+    requeued = failed = 0
+    for design_id, attempts in candidates:
+        owner = new_lease_owner()
+        if attempts >= settings.GENERATION_MAX_ATTEMPTS:
+            # Take the lease first so we don't race a reaper that is requeueing it.
+            if acquire_lease(design_id, owner):
+                fail_generation(design_id, owner)
+                log(f"[REAPER] Design {design_id} failed after {attempts} attempts; quota refunded.")
+                failed += 1
+        elif acquire_lease(design_id, owner):
+            dispatch_generation(design_id, lease_owner=owner)
+            log(f"[REAPER] Requeued design {design_id} (attempt {attempts + 1}).")
+            requeued += 1
+    return requeued, failed
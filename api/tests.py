@@ -1,3 +1,349 @@
-from django.test import TestCase
+import datetime
+import os
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+import brotli
+import dj_database_url
+from django.core.cache import cache
+from django.db import connection, connections
+from django.http import HttpResponse
+from django.db.migrations.executor import MigrationExecutor
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import retention, storage
+from .authentication import _UserCache, user_cache
+from .generation import render_parameters
+from .middleware import CompressionMiddleware
+from .models import ImageBlob, TattooDesign, TattooStyle, User, UserFavorite
+from .retention import sweep_orphan_images
+from .serializers import ClaimsTokenObtainPairSerializer
+from .storage import LocalBlobStore, release_blob, store_blob
+from .tasks import generate_tattoo_from_prompt, reap_expired_generations
+
+
+class BlobStoreMixin:
+    """Points the process-wide blob store at a throwaway LocalBlobStore."""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.store = LocalBlobStore(self.media_root)
+        patcher = mock.patch.object(storage, '_blob_store', self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+@override_settings(ORPHAN_IMAGE_GRACE_HOURS=0)
+class BlobStoreTests(BlobStoreMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('artist')
+        self.style = TattooStyle.objects.create(name='gothic', display_name='Gothic')
+
+    def sweep(self):
+        return sweep_orphan_images(self.store, log=lambda message: None)
+
+    def test_identical_bytes_are_stored_once(self):
+        first = store_blob(b'tattoo')
+        second = store_blob(b'tattoo')
+
+        self.assertEqual(first, second)
+        objects, _ = self.store.list(storage.GENERATED_IMAGES_PREFIX)
+        self.assertEqual([obj['key'] for obj in objects], [first])
+        self.assertEqual(ImageBlob.objects.get(key=first).ref_count, 2)
+
+    def test_deleting_a_design_releases_its_images(self):
+        key = store_blob(b'tattoo')
+        design = TattooDesign.objects.create(
+            user=self.user, style=self.style, prompt='a dragon', generated_image=key, preview_image=key,
+        )
+        self.assertEqual(ImageBlob.objects.get(key=key).ref_count, 1)
+        store_blob(b'tattoo')
+
+        design.delete()
+        self.assertEqual(ImageBlob.objects.get(key=key).ref_count, 0)
+        self.assertEqual(self.sweep(), (1, 1))
+        self.assertFalse(ImageBlob.objects.filter(key=key).exists())
+        self.assertEqual(self.store.list(storage.GENERATED_IMAGES_PREFIX)[0], [])
+
+    def test_sweep_keeps_a_blob_referenced_after_listing(self):
+        key = store_blob(b'tattoo')
+        release_blob(key)
+        delete_orphans = retention._delete_orphans
+
+        def reuse_then_delete(store, keys):
+            # store_blob takes a reference between the sweep's listing and its delete.
+            self.assertEqual(store_blob(b'tattoo'), key)
+            return delete_orphans(store, keys)
+
+        with mock.patch('api.retention._delete_orphans', side_effect=reuse_then_delete):
+            self.assertEqual(self.sweep(), (1, 0))
+        self.assertEqual(self.store.get(key), b'tattoo')
+        self.assertEqual(ImageBlob.objects.get(key=key).ref_count, 1)
+
+    def test_object_without_a_row_is_uploaded_again(self):
+        key = store_blob(b'tattoo')
+        ImageBlob.objects.filter(key=key).delete()
+
+        with mock.patch.object(self.store, 'put', wraps=self.store.put) as put:
+            self.assertEqual(store_blob(b'tattoo'), key)
+        put.assert_called_once_with(key, b'tattoo', 'image/png')
+        self.assertEqual(ImageBlob.objects.get(key=key).ref_count, 1)
+
+    def test_sweep_only_looks_up_legacy_keys_on_designs(self):
+        key = store_blob(b'tattoo')
+        legacy = 'generated_tattoos/tattoo_1.png'
+        self.store.put(legacy, b'legacy', 'image/png')
+        TattooDesign.objects.create(user=self.user, style=self.style, prompt='a dragon', generated_image=legacy)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.sweep(), (2, 0))
+        design_lookups = [q['sql'] for q in queries.captured_queries if 'api_tattoodesign' in q['sql']]
+        self.assertEqual(len(design_lookups), 3)
+        self.assertTrue(all(key not in sql for sql in design_lookups))
+
+        self.store.delete([legacy])
+        with CaptureQueriesContext(connection) as queries:
+            self.sweep()
+        self.assertFalse(any('api_tattoodesign' in q['sql'] for q in queries.captured_queries))
+
+    def test_sweep_deletes_row_less_and_legacy_orphans(self):
+        orphan = store_blob(b'orphan')
+        ImageBlob.objects.filter(key=orphan).delete()
+        legacy = 'generated_tattoos/tattoo_1.png'
+        self.store.put(legacy, b'legacy', 'image/png')
+        kept = store_blob(b'kept', content_type='image/jpeg', extension='jpg', prefix=storage.SOURCE_IMAGES_PREFIX)
+
+        self.assertEqual(self.sweep(), (3, 2))
+        self.assertEqual([obj['key'] for obj in self.store.list('')[0]], [kept])
+        self.assertFalse(ImageBlob.objects.filter(key=orphan).exists())
+
+
+@override_settings(COMPRESSION_MIN_BYTES=1024)
+class CompressionMiddlewareTests(SimpleTestCase):
+    body = b'{"designs": [' + b'{"prompt": "a dragon"},' * 200 + b']}'
+
+    def compress(self, accept_encoding):
+        middleware = CompressionMiddleware(lambda request: HttpResponse(self.body, content_type='application/json'))
+        return middleware(RequestFactory().get('/api/designs/', HTTP_ACCEPT_ENCODING=accept_encoding))
+
+    def test_brotli_is_preferred(self):
+        response = self.compress('gzip, deflate, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content), self.body)
+
+    def test_gzip_without_brotli_support(self):
+        response = self.compress('gzip, br;q=0')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+
+@override_settings(
+    FULL_RENDER_SIZE=1024, PREVIEW_RENDER_SIZE=512, FULL_INFERENCE_STEPS=4, PREVIEW_INFERENCE_STEPS=1,
+    IMG2IMG_FULL_INFERENCE_STEPS=40, IMG2IMG_PREVIEW_INFERENCE_STEPS=12,
+)
+class RenderParametersTests(SimpleTestCase):
+
+    def test_steps_follow_the_model(self):
+        self.assertEqual(render_parameters('9:16 Portrait'), {'width': 576, 'height': 1024, 'num_inference_steps': 4})
+        self.assertEqual(render_parameters('', preview=True)['num_inference_steps'], 1)
+        self.assertEqual(render_parameters('', from_image=True)['num_inference_steps'], 40)
+        self.assertEqual(render_parameters('', preview=True, from_image=True)['num_inference_steps'], 12)
+
+
+class UserCacheTests(TestCase):
+
+    def setUp(self):
+        self.users = [User.objects.create_user(f'artist{i}') for i in range(3)]
+
+    @override_settings(AUTH_USER_CACHE_MAX_ENTRIES=2)
+    def test_least_recently_used_user_is_evicted(self):
+        cache = _UserCache()
+        first, second, third = self.users
+        cache.get(first.pk)
+        cache.get(second.pk)
+        cache.get(first.pk)
+        cache.get(third.pk)
+
+        self.assertEqual(list(cache._entries), [str(first.pk), str(third.pk)])
+        with self.assertNumQueries(0):
+            cache.get(first.pk)
+
+    @override_settings(AUTH_USER_CACHE_SECONDS=30)
+    def test_expired_users_are_dropped_on_insert(self):
+        cache = _UserCache()
+        with mock.patch('api.authentication.time.monotonic', side_effect=[0, 10, 100]):
+            for user in self.users:
+                cache.get(user.pk)
+        self.assertEqual(list(cache._entries), [str(self.users[-1].pk)])
+
+
+class DesignPollingTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('artist')
+        self.addCleanup(user_cache.invalidate, self.user.pk)
+        style = TattooStyle.objects.create(name='gothic', display_name='Gothic')
+        self.designs = [
+            TattooDesign.objects.create(user=self.user, style=style, prompt='a dragon') for _ in range(3)
+        ]
+        self.client = APIClient()
+        token = ClaimsTokenObtainPairSerializer.get_token(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def assertUnchangedPollIsOneQuery(self, url):
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_unchanged_list_poll_is_one_query(self):
+        self.assertUnchangedPollIsOneQuery('/api/designs/')
+
+    def test_unchanged_detail_poll_is_one_query(self):
+        self.assertUnchangedPollIsOneQuery(f'/api/designs/{self.designs[0].pk}/')
+
+    def test_changed_list_is_sent_again(self):
+        etag = self.client.get('/api/designs/')['ETag']
+        TattooDesign.objects.filter(pk=self.designs[0].pk).update(status='completed', updated_at=timezone.now())
+        response = self.client.get('/api/designs/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class AdminChangelistTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', password='admin'))
+        self.style = TattooStyle.objects.create(name='gothic', display_name='Gothic')
+
+    def add_designs(self, count):
+        for i in range(count):
+            user = User.objects.create_user(f'artist{User.objects.count()}')
+            design = TattooDesign.objects.create(user=user, style=self.style, prompt='a dragon')
+            UserFavorite.objects.create(user=user, design=design)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        for url in ('/admin/api/tattoodesign/', '/admin/api/userfavorite/', '/admin/api/user/'):
+            with self.subTest(url=url):
+                self.add_designs(2)
+                with self.assertNumQueries(4):
+                    self.assertEqual(self.client.get(url).status_code, 200)
+                self.add_designs(20)
+                with self.assertNumQueries(4):
+                    self.assertEqual(self.client.get(url).status_code, 200)
+
+
+def add_replica_alias(alias, url):
+    """
+    Adds a read replica alias the way settings.py does for each
+    DATABASE_REPLICA_URLS entry. Done at import, before the test runner sets
+    up databases, so TEST['MIRROR'] points it at the test database.
+    """
+    replica = dj_database_url.parse(url)
+    replica['TEST'] = {'MIRROR': 'default'}
+    configured = connections.configure_settings({'default': connections.settings['default'], alias: replica})
+    connections.settings[alias] = configured[alias]
+
+
+add_replica_alias('replica_1', f"sqlite:///{os.path.join(tempfile.gettempdir(), 'replica_1.sqlite3')}")
+
+
+@override_settings(READ_REPLICAS=['replica_1'])
+class ReplicaRoutingTests(TransactionTestCase):
+    """Mirrors share the test database, so reads must see committed rows."""
+    databases = {'default', 'replica_1'}
+
+    def setUp(self):
+        self.user = User.objects.create_user('artist')
+        self.addCleanup(user_cache.invalidate, self.user.pk)
+        self.addCleanup(cache.clear)
+        style = TattooStyle.objects.create(name='gothic', display_name='Gothic')
+        self.design = TattooDesign.objects.create(user=self.user, style=style, prompt='a dragon')
+        self.client = APIClient()
+        token = ClaimsTokenObtainPairSerializer.get_token(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def queries_by_alias(self, method, url):
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica_1']) as replica:
+            response = getattr(self.client, method)(url)
+        self.assertLess(response.status_code, 400)
+        design_queries = lambda context: [q for q in context.captured_queries if 'api_tattoodesign' in q['sql']]
+        return design_queries(primary), design_queries(replica)
+
+    def test_list_and_retrieve_read_from_the_replica(self):
+        for url in ('/api/designs/', f'/api/designs/{self.design.pk}/'):
+            with self.subTest(url=url):
+                primary, replica = self.queries_by_alias('get', url)
+                self.assertEqual(primary, [])
+                self.assertNotEqual(replica, [])
+
+    def test_writes_go_to_the_primary_and_pin_the_user(self):
+        primary, replica = self.queries_by_alias('post', f'/api/designs/{self.design.pk}/favorite/')
+        self.assertTrue(any(q['sql'].startswith('UPDATE') for q in primary))
+        self.assertTrue(UserFavorite.objects.filter(user=self.user, design=self.design).exists())
+
+        primary, replica = self.queries_by_alias('get', '/api/designs/')
+        self.assertNotEqual(primary, [])
+        self.assertEqual(replica, [])
+
+
+class GenerationRecoveryTests(BlobStoreMixin, TransactionTestCase):
+    """The task runs in the test thread here, so it needs real commits."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('artist')
+        self.style = TattooStyle.objects.create(name='gothic', display_name='Gothic')
+
+    def test_requeued_design_without_prompt_fails_and_refunds(self):
+        design = TattooDesign.objects.create(
+            user=self.user, style=self.style, prompt='a dragon', status='processing', quota_charged=True,
+        )
+        # A design stuck before leases existed: no lease and no final prompt.
+        TattooDesign.objects.filter(pk=design.pk).update(created_at=timezone.now() - datetime.timedelta(days=1))
+
+        def run_inline(design_id, lease_owner=None):
+            generate_tattoo_from_prompt(design_id, lease_owner=lease_owner)
+
+        with mock.patch('api.tasks.dispatch_generation', side_effect=run_inline), \
+                mock.patch('api.tasks.text_to_image') as text_to_image:
+            reap_expired_generations(log=lambda message: None)
+
+        text_to_image.assert_not_called()
+        design.refresh_from_db()
+        self.assertEqual(design.status, 'failed')
+        self.assertFalse(design.quota_charged)
+
+
+class FinalPromptBackfillTests(TransactionTestCase):
+    migrate_from = [('api', '0003_retention')]
+    migrate_to = [('api', '0004_generation_leases')]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+        super().tearDown()
+
+    def test_stuck_designs_get_a_prompt(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_from)
+        apps = executor.loader.project_state(self.migrate_from).apps
+        user = apps.get_model('api', 'User').objects.create(username='artist')
+        style = apps.get_model('api', 'TattooStyle').objects.create(name='gothic', display_name='Gothic')
+        Design = apps.get_model('api', 'TattooDesign')
+        stuck = Design.objects.create(user=user, style=style, prompt='a dragon', status='processing')
+        done = Design.objects.create(user=user, style=style, prompt='a rose', status='completed')
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_to)
+        Design = executor.loader.project_state(self.migrate_to).apps.get_model('api', 'TattooDesign')
+        self.assertEqual(Design.objects.get(pk=stuck.pk).final_prompt, 'Gothic style tattoo, a dragon')
+        self.assertEqual(Design.objects.get(pk=done.pk).final_prompt, '')
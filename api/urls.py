@@ -13,6 +13,8 @@ from .views import (
     GalleryListView,
     FavoriteListView,
     VerifyMobilePurchaseView,
+    GenerationLoadView,
+    GenerationStatsView,
 )
 
 router = DefaultRouter()
@@ -37,6 +39,12 @@ urlpatterns = [
     path('gallery/', GalleryListView.as_view(), name='gallery-list'),
     path('favorites/', FavoriteListView.as_view(), name='favorite-list'),
 
+    # Generation load, for client-side backoff
+    path('status/load/', GenerationLoadView.as_view(), name='generation-load'),
+
+    # Generation analytics, for staff
+    path('stats/generations/', GenerationStatsView.as_view(), name='generation-stats'),
+
     # Subscription
     path('subscriptions/verify-purchase/', VerifyMobilePurchaseView.as_view(), name='verify-purchase'),
 ]
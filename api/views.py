@@ -1,20 +1,58 @@
 from rest_framework import generics, viewsets, status
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, SAFE_METHODS
 from rest_framework.decorators import action
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters
-import threading
+from rest_framework.settings import api_settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.conf import settings
+from django.db.models import Count, Max
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 
 from .models import User, TattooStyle, TattooDesign, UserFavorite, APIUsage, Gallery
 from .serializers import (
     UserSerializer, TattooStyleSerializer, TattooDesignSerializer,
     TattooDesignCreateSerializer, GalleryDesignSerializer
 )
-from .permissions import HasCreationQuota
-from .tasks import generate_tattoo_from_prompt
+from .permissions import HasCreationQuota, IsStaffUser, QUOTA_ENDPOINT
+from .authentication import get_user_model_instance
+from .serializers import ClaimsTokenObtainPairSerializer
+from .tasks import cancel_generation, dispatch_generation
+from .export import designs_after, stream_design_library
+from .storage import SOURCE_UPLOADS_PREFIX, get_blob_store, store_blob
+from .renderers import ZipRenderer
+from .admission import admit_generation, load_status
+from .db_routers import ReplicaReadMixin
+from .conditional import make_etag, respond_conditionally
+from .stats import generation_stats, record_transition
+from .idempotency import (
+    IDEMPOTENCY_HEADER, MAX_KEY_LENGTH, claim_key, complete_key, release_key, replay_response,
+    request_fingerprint,
+)
 import datetime
 
+def touch_design(design_id):
+    """Bumps updated_at so conditional GETs see a change that isn't a field on the design."""
+    TattooDesign.objects.filter(pk=design_id).update(updated_at=timezone.now())
+
+class SparseFieldsetListMixin:
+    """
+    Lists through the serializer's `.values()` fast path when `?fields=`
+    only asks for fields it supports (see SparseFieldsetMixin).
+    """
+
+    def list(self, request, *args, **kwargs):
+        serializer_class = self.get_serializer_class()
+        # Paginated lists take the regular path.
+        if self.paginator is None and hasattr(serializer_class, 'serialize_values'):
+            queryset = self.filter_queryset(self.get_queryset())
+            data = serializer_class.serialize_values(queryset, self.get_serializer_context())
+            if data is not None:
+                return Response(data)
+        return super().list(request, *args, **kwargs)
+
 class UserRegisterView(generics.CreateAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
@@ -30,9 +68,13 @@ class UserProfileView(generics.RetrieveUpdateAPIView):
     permission_classes = [IsAuthenticated]
 
     def get_object(self):
-        return self.request.user
+        # request.user is usually a ClaimsUser built from the token; load the
+        # real row, from the short-lived cache for reads and fresh for writes.
+        if self.request.method in SAFE_METHODS:
+            return get_user_model_instance(self.request.user)
+        return User.objects.get(pk=self.request.user.id)
 
-class TattooStyleListView(generics.ListAPIView):
+class TattooStyleListView(ReplicaReadMixin, generics.ListAPIView):
     """
     GET /api/styles/ -> List all active tattoo styles.
     Used for the style selection section on the prompt screen.
@@ -41,7 +83,7 @@ class TattooStyleListView(generics.ListAPIView):
     serializer_class = TattooStyleSerializer
     permission_classes = [AllowAny]
 
-class TattooDesignViewSet(viewsets.ModelViewSet):
+class TattooDesignViewSet(ReplicaReadMixin, SparseFieldsetListMixin, viewsets.ModelViewSet):
     """
     ViewSet for creating and managing tattoo designs.
     """
@@ -49,21 +91,50 @@ class TattooDesignViewSet(viewsets.ModelViewSet):
     serializer_class = TattooDesignSerializer
 
     def get_permissions(self):
-        if self.action == 'create':
-            permission_classes = [IsAuthenticated, HasCreationQuota]
-        else:
-            permission_classes = [IsAuthenticated]
-        return [permission() for permission in permission_classes]
+        # The creation quota is checked in create(), after idempotent replays.
+        return [IsAuthenticated()]
 
     def get_queryset(self):
         # Only return designs for the currently authenticated user.
-        return TattooDesign.objects.filter(user=self.request.user)
+        return TattooDesign.objects.filter(user_id=self.request.user.id)
 
     def get_serializer_class(self):
         if self.action == 'create':
             return TattooDesignCreateSerializer
         return TattooDesignSerializer
 
+    def list(self, request, *args, **kwargs):
+        """
+        Answers polling with 304 when nothing changed. Any change to one of the
+        user's designs bumps updated_at, and deletions change the count, so
+        one aggregate over the user's designs is enough to validate the list.
+        """
+        state = self.get_queryset().aggregate(last_modified=Max('updated_at'), count=Count('pk'))
+        etag = make_etag(
+            'designs', request.user.id, state['count'], state['last_modified'],
+            request.accepted_renderer.format, request.get_full_path(),
+        )
+        return respond_conditionally(
+            request, etag, state['last_modified'],
+            lambda: super(TattooDesignViewSet, self).list(request, *args, **kwargs),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            last_modified = (
+                self.get_queryset().filter(pk=kwargs['pk']).values_list('updated_at', flat=True).first()
+            )
+        except (ValueError, DjangoValidationError):
+            last_modified = None
+        if last_modified is None:
+            # Unknown design or malformed id; let the normal path produce the 404.
+            return super().retrieve(request, *args, **kwargs)
+        etag = make_etag('design', kwargs['pk'], last_modified, request.accepted_renderer.format)
+        return respond_conditionally(
+            request, etag, last_modified,
+            lambda: super(TattooDesignViewSet, self).retrieve(request, *args, **kwargs),
+        )
+
     def perform_create(self, serializer):
         """
         Overrides the default create behavior to construct the prompt and
@@ -85,26 +156,38 @@ class TattooDesignViewSet(viewsets.ModelViewSet):
         if customizations:
             final_prompt += ", " + ", ".join(customizations)
 
-        # 2. Create the TattooDesign object
+        # 2. Store the raw source photo, if any, for the task to preprocess, and create the TattooDesign object
+        source_image = None
+        upload = data.get('source_image')
+        if upload:
+            extension = 'jpg' if upload.image_format == 'JPEG' else 'png'
+            source_image = store_blob(
+                b''.join(upload.chunks()), content_type=f'image/{upload.image_format.lower()}',
+                extension=extension, prefix=SOURCE_UPLOADS_PREFIX,
+            )
+
         design = TattooDesign.objects.create(
-            user=self.request.user,
+            user_id=self.request.user.id,
             prompt=base_prompt, 
             style=style,
-            status='processing'
+            source_image=source_image,
+            status='processing',
+            final_prompt=final_prompt,
+            aspect_ratio=data.get('aspect_ratio', ''),
+            progressive=data.get('progressive', settings.PROGRESSIVE_GENERATION_DEFAULT),
+            quota_charged=not self.request.user.is_pro,
         )
 
+        record_transition(design.id, design.status, style_id=style.id)
+
         # 3. Trigger the async task for tattoo generation
-        task_thread = threading.Thread(
-            target=generate_tattoo_from_prompt,
-            args=(design.id, final_prompt)
-        )
-        task_thread.start()
+        dispatch_generation(design.id)
 
         # 4. Update API usage for free users
         if not self.request.user.is_pro:
             usage, _ = APIUsage.objects.get_or_create(
-                user=self.request.user,
-                endpoint='/api/designs/',
+                user_id=self.request.user.id,
+                endpoint=QUOTA_ENDPOINT,
                 date=datetime.date.today()
             )
             usage.requests_count += 1
@@ -114,8 +197,43 @@ class TattooDesignViewSet(viewsets.ModelViewSet):
 
     def create(self, request, *args, **kwargs):
         """
-        Customize the response for the create action.
+        POST /api/designs/ with an Idempotency-Key header is safe to retry:
+        a repeat of a completed request returns the original response without
+        creating anything, and a repeat that arrives while the first is still
+        running waits for its result.
         """
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return self._create(request)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {'detail': f'{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        record, owner = claim_key(request.user.id, key, request_fingerprint(request))
+        if not owner:
+            return replay_response(record)
+        try:
+            response = self._create(request)
+        except Exception:
+            release_key(record)
+            raise
+        # Only a created design is replayed; anything else can simply be retried.
+        if status.is_success(response.status_code):
+            complete_key(record, response)
+        else:
+            release_key(record)
+        return response
+
+    def _create(self, request):
+        quota = HasCreationQuota()
+        if not quota.has_permission(request, self):
+            self.permission_denied(request, message=quota.message)
+
+        # Turn work away before validating or creating anything when saturated.
+        admit_generation(request.user)
+
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         self.perform_create(serializer)
@@ -124,13 +242,33 @@ class TattooDesignViewSet(viewsets.ModelViewSet):
         headers = self.get_success_headers(response_serializer.data)
         return Response(response_serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
+    @action(detail=True, methods=['post'], url_path='cancel')
+    def cancel(self, request, pk=None):
+        """
+        POST /api/designs/{id}/cancel/ -> Stop a design that is still generating.
+        Free-tier creations are refunded unless a preview was already delivered.
+        """
+        design = self.get_object()
+        if design.status in TattooDesign.ACTIVE_STATUSES:
+            cancel_generation(design.pk)
+            design.refresh_from_db()
+        if design.status != 'cancelled':
+            return Response(
+                {'detail': f'Only designs that are still generating can be cancelled; this one is {design.status}.'},
+                status=status.HTTP_409_CONFLICT,
+            )
+        return Response(self.get_serializer(design).data)
+
     @action(detail=True, methods=['post'], url_path='favorite')
     def favorite(self, request, pk=None):
         """
         POST /api/designs/{id}/favorite/ -> Add a design to user's favorites.
         """
         design = self.get_object()
-        UserFavorite.objects.get_or_create(user=request.user, design=design)
+        _, created = UserFavorite.objects.get_or_create(user_id=request.user.id, design=design)
+        if created:
+            # is_user_favorite is part of the design's representation
+            touch_design(design.pk)
         return Response({'status': 'favorited'}, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=['delete'], url_path='unfavorite')
@@ -139,10 +277,68 @@ class TattooDesignViewSet(viewsets.ModelViewSet):
         DELETE /api/designs/{id}/favorite/ -> Remove a design from user's favorites.
         """
         design = self.get_object()
-        UserFavorite.objects.filter(user=request.user, design=design).delete()
+        deleted, _ = UserFavorite.objects.filter(user_id=request.user.id, design=design).delete()
+        if deleted:
+            touch_design(design.pk)
         return Response({'status': 'unfavorited'}, status=status.HTTP_204_NO_CONTENT)
 
-class GalleryListView(generics.ListAPIView):
+    @action(
+        detail=False, methods=['get'], url_path='export',
+        renderer_classes=[*api_settings.DEFAULT_RENDERER_CLASSES, ZipRenderer],
+    )
+    def export(self, request):
+        """
+        GET /api/designs/export/ -> Streams a ZIP of the user's designs with a manifest.json.
+        GET /api/designs/export/?after={id} -> Resumes an interrupted export after design {id}.
+        """
+        queryset = self.get_queryset()
+        after = request.query_params.get('after')
+        if after:
+            try:
+                queryset = designs_after(queryset, after)
+            except (ValueError, DjangoValidationError):
+                queryset = None
+            if queryset is None:
+                return Response({'after': 'Unknown design id.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        response = StreamingHttpResponse(
+            stream_design_library(queryset, get_blob_store()),
+            content_type='application/zip',
+        )
+        response['Content-Disposition'] = 'attachment; filename="tattoo-designs.zip"'
+        return response
+
+class GenerationLoadView(generics.GenericAPIView):
+    """
+    GET /api/status/load/ -> Current generation load and whether free/Pro requests are being admitted.
+    Lets clients back off before submitting a prompt.
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request, *args, **kwargs):
+        load = load_status()
+        headers = {'Retry-After': str(load['retry_after'])} if load['retry_after'] else {}
+        return Response(load, headers=headers)
+
+class GenerationStatsView(generics.GenericAPIView):
+    """
+    GET /api/stats/generations/ -> Generation counts, failure rates and latency percentiles (staff only).
+    GET /api/stats/generations/?hours=168&style=traditional -> Last week, one style.
+    Served from the hourly GenerationStatsBucket rollups, not from TattooDesign.
+    """
+    permission_classes = [IsAuthenticated, IsStaffUser]
+
+    def get(self, request, *args, **kwargs):
+        try:
+            hours = int(request.query_params.get('hours', 24))
+        except ValueError:
+            return Response({'hours': 'Expected a whole number of hours.'}, status=status.HTTP_400_BAD_REQUEST)
+        hours = min(max(hours, 1), settings.STATS_MAX_HOURS)
+        current_hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+        since = current_hour - datetime.timedelta(hours=hours - 1)
+        return Response(generation_stats(since, style=request.query_params.get('style')))
+
+class GalleryListView(ReplicaReadMixin, SparseFieldsetListMixin, generics.ListAPIView):
     """
     GET /api/gallery/ -> Returns public completed designs for the home screen grid and search page.
     Supports filtering by style and searching by prompt text.
@@ -155,7 +351,7 @@ class GalleryListView(generics.ListAPIView):
     filterset_fields = ['style__name'] # example: ?style__name=gothic_text
     search_fields = ['prompt'] # example: ?search=dragon
 
-class FavoriteListView(generics.ListAPIView):
+class FavoriteListView(ReplicaReadMixin, SparseFieldsetListMixin, generics.ListAPIView):
     """
     GET /api/favorites/ -> Gets all designs favorited by the current user.
     """
@@ -163,7 +359,7 @@ class FavoriteListView(generics.ListAPIView):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return TattooDesign.objects.filter(userfavorite__user=self.request.user)
+        return TattooDesign.objects.filter(userfavorite__user_id=self.request.user.id)
 
 # Placeholder for subscription verification
 class VerifyMobilePurchaseView(generics.GenericAPIView):
@@ -187,9 +383,15 @@ class VerifyMobilePurchaseView(generics.GenericAPIView):
         # return Response({'status': 'failed'}, status=400)
         
         # This is a complex feature, so for I am just simulating success payment scenario
-        user = request.user
+        user = User.objects.get(pk=request.user.id)
         user.is_pro = True
-        user.save()
-        
-        
-        return Response({'status': 'Subscription activated successfully.'})
\ No newline at end of file
+        user.save()  # bumps token_version, so tokens claiming is_pro=False stop working
+
+        # Hand back a fresh pair carrying the new claims.
+        refresh = ClaimsTokenObtainPairSerializer.get_token(user)
+        return Response({
+            'status': 'Subscription activated successfully.',
+            'is_pro': True,
+            'refresh': str(refresh),
+            'access': str(refresh.access_token),
+        })
\ No newline at end of file
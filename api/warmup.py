@@ -0,0 +1,75 @@
+import io
+import sys
+
+# Modules the web process should only load once something needs them.
+LAZY_MODULES = ('boto3', 'botocore', 'requests', 'PIL.Image')
+
+
+def _host():
+    from django.conf import settings
+
+    for host in settings.ALLOWED_HOSTS:
+        if host and '*' not in host:
+            return host.lstrip('.')
+    return 'localhost'
+
+
+def request_path(path):
+    """
+    Sends one GET through the WSGI application in-process, exactly as a
+    worker would serve it, and returns the status code.
+    """
+    from DeepTattooAI.wsgi import application
+
+    path, _, query = path.partition('?')
+    host = _host()
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'SERVER_NAME': host,
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': host,
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    statuses = []
+
+    def start_response(status, headers, exc_info=None):
+        statuses.append(status)
+
+    body = application(environ, start_response)
+    try:
+        for _ in body:
+            pass
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    return int(statuses[0].split()[0])
+
+
+def warm_up(log=print):
+    """
+    Does the work every worker would otherwise repeat on its first request:
+    imports the URLconf and everything it pulls in, and serves WARMUP_PATH
+    once through the full middleware stack. Meant to run in the gunicorn
+    master before forking; the database connections it opens are closed
+    again so no worker inherits them.
+    """
+    from django.conf import settings
+    from django.db import connections
+
+    try:
+        status = request_path(settings.WARMUP_PATH)
+        log(f"Warm-up request to {settings.WARMUP_PATH} returned {status}.")
+    except Exception as e:
+        # A cold database shouldn't stop the dyno from booting.
+        log(f"Warm-up request to {settings.WARMUP_PATH} failed: {e}")
+    finally:
+        connections.close_all()
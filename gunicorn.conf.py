@@ -0,0 +1,41 @@
+"""
+Gunicorn settings for the web dyno.
+
+The app is loaded and warmed up once in the master (preload_app), then
+workers are forked from it. They start with Django, DRF and the URLconf
+already imported and share those pages with the master copy-on-write,
+instead of each importing everything cold.
+"""
+import gc
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+threads = int(os.environ.get('GUNICORN_THREADS', '1'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '30'))
+preload_app = True
+
+# Keep the master's heap compact while the app loads; collections free
+# objects all over and leave holes that workers would copy on write.
+gc.disable()
+
+
+def when_ready(server):
+    from api.warmup import warm_up
+
+    warm_up(log=server.log.info)
+
+
+def pre_fork(server, worker):
+    # Hide everything the master allocated from the collector, so collections
+    # in the worker don't write to (and copy) the shared pages.
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    gc.enable()
+    # The master closed its connections after warming up; make sure nothing
+    # opened since is shared with the worker.
+    from django.db import connections
+
+    connections.close_all()